@@ -0,0 +1,48 @@
+import sys
+
+from src.data.model.daily_price import DailyPrice
+from src.data.store import Store, COLUMNAR_PROFILE
+
+"""
+Copies DailyPrice (partitioned by ticker) into DailyPriceByYear (partitioned by ticker and year), the table of
+Store(..., bucketed=True). The source is scanned page by page and every page written with
+Store.bulk_insert_values (unlogged batches per (ticker, year), concurrent), created_at / updated_at kept.
+The copy is idempotent (upserts), run it again to pick up rows written to the source meanwhile. The source table is
+left as is.
+
+python -m scripts.migrate_daily_price <host> <keyspace>
+"""
+
+SELECT = "SELECT ticker, date, name, currency, close, high, low, created_at, updated_at FROM {table}"
+
+
+def migrate(hosts, keyspace, fetch_size=5000, batch_size=50, concurrency=64, retries=3):
+    # return: {"rows", "failed_rows", "errors", "seconds"}
+    store = Store(hosts=hosts, keyspace=keyspace, bucketed=True)
+    statement = store.session.prepare(SELECT.format(table=DailyPrice.column_family_name()))
+    statement.fetch_size = fetch_size
+
+    total = {"rows": 0, "failed_rows": 0, "errors": [], "seconds": 0.0}
+    result = store.session.execute(statement, execution_profile=COLUMNAR_PROFILE)
+    while True:
+        values = []
+        for ticker, date, name, currency, close, high, low, created_at, updated_at in result.current_rows:
+            date = date.date()
+            values.append((ticker, date, date.year, name,
+                           None if currency is None else (currency.code, currency.country),
+                           close, high, low, created_at, updated_at))
+
+        stats = store.bulk_insert_values(values, batch_size, concurrency, retries)
+        for name in total:
+            total[name] += stats[name]
+        print(total["rows"], "rows,", total["failed_rows"], "failed,", stats["rows_per_sec"], "rows/s")
+
+        if not result.has_more_pages:
+            break
+        result.fetch_next_page()
+
+    return total
+
+
+if __name__ == "__main__":
+    migrate(hosts=[sys.argv[1]], keyspace=sys.argv[2])
@@ -0,0 +1,53 @@
+import time
+
+import numpy as np
+
+from src.accu_sim import run_stats
+from src.accumulator import AccumulatorContract, simulate
+
+"""
+Convergence of pseudo-random vs scrambled Sobol (Brownian bridge) paths:
+RMSE of the estimate against a large pseudo-random reference over independent runs, per number of paths
+(the reference's own stderr floors the RMSE at the largest path counts).
+
+python -m scripts.qmc_benchmark
+"""
+
+STRIKE, KNOCK_OUT, VOL = 95, 105, 5
+PATHS = [2 ** k for k in range(10, 17, 2)]
+RUNS = 20
+
+
+def rmse(estimates, reference):
+    return np.sqrt(np.mean((np.asarray(estimates) - reference) ** 2))
+
+
+def benchmark(name, value, reference):
+    print(name)
+    print("%10s %14s %14s %8s %10s %10s" % ("paths", "pseudo RMSE", "sobol RMSE", "ratio", "pseudo s", "sobol s"))
+    for paths in PATHS:
+        ts = time.time()
+        pseudo = [value(paths, seed, "pseudo") for seed in range(RUNS)]
+        te = time.time()
+        sobol = [value(paths, seed, "sobol") for seed in range(RUNS)]
+        tq = time.time()
+        print("%10d %14.2f %14.2f %8.1f %10.3f %10.3f" % (paths, rmse(pseudo, reference), rmse(sobol, reference),
+                                                          rmse(pseudo, reference) / rmse(sobol, reference),
+                                                          (te - ts) / RUNS, (tq - te) / RUNS))
+
+
+if __name__ == "__main__":
+    # accu_sim.FastSimulation contract: 12 monthly normal returns
+    reference = run_stats(2 ** 23, STRIKE, KNOCK_OUT, VOL, seed=12345)["mean"]
+    benchmark("accu_sim (12 monthly observations)",
+              lambda paths, seed, generator: run_stats(paths, STRIKE, KNOCK_OUT, VOL, seed=seed,
+                                                       generator=generator)["mean"],
+              reference)
+
+    # GBM with daily observation, monthly settlement
+    contract = AccumulatorContract(strike=STRIKE, knock_out=KNOCK_OUT, std=0.2, observations=21)
+    reference = simulate(contract, 2 ** 21, block_size=2 ** 14, seed=12345)["mean"]
+    benchmark("accumulator (252 daily observations)",
+              lambda paths, seed, generator: simulate(contract, paths, block_size=2 ** 14, seed=seed,
+                                                      generator=generator)["mean"],
+              reference)
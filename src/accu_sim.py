@@ -1,9 +1,12 @@
+import math
 import random
 import numpy as np
 from collections import OrderedDict
-from numba import int32, float32
+from numba import int32, float32, njit, prange, get_num_threads, set_num_threads, config
 from numba.experimental import jitclass
 
+from src.qmc import normal_blocks, replication_seeds
+
 """
 For simplicity, I'm going to make the following assumptions:
 
@@ -27,6 +30,367 @@ For 1 million simulations per pair of K,sigma(vol) , it takes about 2 seconds on
 
 """
 
+"""
+parallel_run() splits the paths into shards (one per worker) and runs them on all cores with numba prange.
+Each shard seeds its own RNG stream from np.random.SeedSequence(seed).spawn(workers), so the payoffs only
+depend on (seed, workers), not on the number of threads or how the shards are scheduled.
+
+run_stats() runs the same paths but only keeps running statistics per shard (constant memory), merged at the end:
+    * mean / variance: Welford's update, shards combined with Chan's parallel formula
+    * knock-out frequency: share of paths terminated at any settlement (a price above knock_out_price), the last one
+      included
+    * quantiles: P-square estimator (Jain & Chlamtac, 1985) per shard, weighted by the number of paths of each shard
+
+Variance reduction (run_stats options, any combination):
+    * antithetic: paths come in pairs of monthly normals z and -z, the sample is the average payoff of the pair
+    * control: control variate X = sum of the 12 monthly prices (knock-out ignored), E[X] = 12 * 100 at zero drift,
+      the sample becomes Y - beta * (X - E[X]) with beta = Cov(Y, X) / Var(X) estimated from the same run
+    * strata: the first month normal is stratified into equally likely strata (path i of a shard in stratum
+      i mod strata), the mean is the average of the stratum means
+The stderr is the one of the resulting estimator, variance_reduction = (plain MC variance / paths) / stderr^2, i.e.
+how many times fewer paths it needs for the same confidence interval. Without any of them the paths are the ones of
+parallel_run().
+
+generator="sobol" draws the 12 monthly normals from scrambled Sobol points with Brownian bridge ordering (see qmc),
+split into replications independent randomizations: the stderr is the one of the mean over the replications.
+"""
+
+# E[sum of the monthly prices]: E[price at month m] = 100 as the monthly returns have mean 1
+CONTROL_MEAN = 12 * 100.0
+
+
+@njit(cache=True)
+def _monthly_prices(volatility):
+    # generate 12 monthly returns from a normal distribution and convert them to a price array
+    returns = np.empty(12)
+    for m in range(12):
+        returns[m] = np.random.normal(0, volatility) / 100 + 1
+    return returns.cumprod() * 100
+
+
+@njit(cache=True)
+def _norm_ppf(p):
+    # inverse standard normal cdf: Acklam's rational approximation + one Halley step on erfc
+    a = (-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02, 1.383577518672690e+02,
+         -3.066479806614716e+01, 2.506628277459239e+00)
+    b = (-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02, 6.680131188771972e+01,
+         -1.328068155288572e+01)
+    c = (-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00, -2.549732539343734e+00,
+         4.374664141464968e+00, 2.938163982698783e+00)
+    d = (7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00, 3.754408661907416e+00)
+
+    p = min(max(p, 1e-300), 1.0 - 1e-16)
+    if p < 0.02425:
+        q = math.sqrt(-2 * math.log(p))
+        x = (((((c[0] * q + c[1]) * q + c[2]) * q + c[3]) * q + c[4]) * q + c[5]) / \
+            ((((d[0] * q + d[1]) * q + d[2]) * q + d[3]) * q + 1)
+    elif p > 1 - 0.02425:
+        q = math.sqrt(-2 * math.log(1 - p))
+        x = -(((((c[0] * q + c[1]) * q + c[2]) * q + c[3]) * q + c[4]) * q + c[5]) / \
+            ((((d[0] * q + d[1]) * q + d[2]) * q + d[3]) * q + 1)
+    else:
+        q = p - 0.5
+        r = q * q
+        x = (((((a[0] * r + a[1]) * r + a[2]) * r + a[3]) * r + a[4]) * r + a[5]) * q / \
+            (((((b[0] * r + b[1]) * r + b[2]) * r + b[3]) * r + b[4]) * r + 1)
+
+    e = 0.5 * math.erfc(-x / math.sqrt(2)) - p
+    u = e * math.sqrt(2 * math.pi) * math.exp(x * x / 2)
+    return x - u / (1 + x * u / 2)
+
+
+@njit(cache=True)
+def _normals(stratum, strata):
+    # 12 monthly standard normals, the first one drawn within stratum (of strata equally likely ones)
+    z = np.empty(12)
+    for m in range(12):
+        z[m] = np.random.standard_normal()
+    if strata > 1:
+        z[0] = _norm_ppf((stratum + np.random.random()) / strata)
+    return z
+
+
+@njit(cache=True)
+def _prices_of(z, volatility):
+    return (volatility * z / 100 + 1).cumprod() * 100
+
+
+@njit(cache=True)
+def _buyer_payoff(share_price, strike_price, knock_out_price):
+    if share_price > knock_out_price:
+        return 0
+    payoff = 1000 * (share_price - strike_price)
+    if strike_price <= share_price <= knock_out_price:
+        return payoff
+    else:
+        return payoff * 2
+
+
+@njit(cache=True)
+def _accumulate(prices, strike_price, knock_out_price):
+    payoff, _ = _accumulate_ko(prices, strike_price, knock_out_price)
+    return payoff
+
+
+@njit(cache=True)
+def _accumulate_ko(prices, strike_price, knock_out_price):
+    # payoff and whether it's been knocked out
+    payoff = 0.0
+    for price in prices:
+        # the accumulator is terminated immediately
+        if price > knock_out_price:
+            return payoff, True
+        payoff += _buyer_payoff(price, strike_price, knock_out_price)
+    return payoff, False
+
+
+@njit(cache=True)
+def _p2_init(p, q, pos, desired, incr):
+    # 5 markers: min, p/2, p, (1+p)/2 quantile and max
+    for i in range(5):
+        q[i] = 0.0
+        pos[i] = i + 1
+    desired[0], desired[1], desired[2], desired[3], desired[4] = 1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5
+    incr[0], incr[1], incr[2], incr[3], incr[4] = 0, p / 2, p, (1 + p) / 2, 1
+
+
+@njit(cache=True)
+def _p2_update(q, pos, desired, incr, x, count):
+    # count: number of observations before x
+    if count < 5:
+        q[count] = x
+        if count == 4:
+            q.sort()
+        return
+
+    # cell k: q[k] <= x < q[k+1]
+    if x < q[0]:
+        q[0] = x
+        k = 0
+    elif x >= q[4]:
+        q[4] = x
+        k = 3
+    else:
+        k = 0
+        while x >= q[k + 1]:
+            k += 1
+    for i in range(k + 1, 5):
+        pos[i] += 1
+    for i in range(5):
+        desired[i] += incr[i]
+
+    # adjust the middle markers with the piecewise parabolic (or linear) formula
+    for i in range(1, 4):
+        d = desired[i] - pos[i]
+        if (d >= 1 and pos[i + 1] - pos[i] > 1) or (d <= -1 and pos[i - 1] - pos[i] < -1):
+            d = 1.0 if d > 0 else -1.0
+            qp = q[i] + d / (pos[i + 1] - pos[i - 1]) * (
+                    (pos[i] - pos[i - 1] + d) * (q[i + 1] - q[i]) / (pos[i + 1] - pos[i])
+                    + (pos[i + 1] - pos[i] - d) * (q[i] - q[i - 1]) / (pos[i] - pos[i - 1]))
+            if q[i - 1] < qp < q[i + 1]:
+                q[i] = qp
+            else:
+                j = i + int(d)
+                q[i] = q[i] + d * (q[j] - q[i]) / (pos[j] - pos[i])
+            pos[i] += d
+
+
+@njit(cache=True)
+def _p2_estimate(p, q, count):
+    if count >= 5:
+        return q[2]
+    # exact for the first few observations
+    return np.quantile(q[:count], p)
+
+
+@njit(parallel=True, cache=True)
+def _parallel_run(seeds, offsets, strike_price, knock_out_price, volatility):
+    payoffs = np.empty(offsets[-1])
+    for w in prange(seeds.size):
+        # the shard owns the RNG state of the thread running it until it's done
+        np.random.seed(seeds[w])
+        for i in range(offsets[w], offsets[w + 1]):
+            payoffs[i] = _accumulate(_monthly_prices(volatility), strike_price, knock_out_price)
+    return payoffs
+
+
+@njit(parallel=True, cache=True)
+def _parallel_stats(seeds, offsets, strike_price, knock_out_price, volatility, probs, out, antithetic, strata):
+    """
+    per shard, over the paths: mean, M2 (sum of squared deviations), knock-out count, quantiles
+    per shard and stratum, over the samples (payoff or antithetic pair average Y, control X):
+        count, mean of Y, mean of X, M2 of Y, M2 of X, co-moment of (Y, X)
+    """
+    workers = seeds.size
+    mean = np.zeros(workers)
+    m2 = np.zeros(workers)
+    knocked = np.zeros(workers, dtype=np.int64)
+    quantiles = np.zeros((workers, probs.size))
+    moments = np.zeros((workers, strata, 6))
+    plain = not antithetic and strata == 1
+    for w in prange(workers):
+        q = np.empty((probs.size, 5))
+        pos = np.empty((probs.size, 5))
+        desired = np.empty((probs.size, 5))
+        incr = np.empty((probs.size, 5))
+        for k in range(probs.size):
+            _p2_init(probs[k], q[k], pos[k], desired[k], incr[k])
+
+        np.random.seed(seeds[w])
+        count = 0
+        sample = 0
+        i = offsets[w]
+        while i < offsets[w + 1]:
+            stratum = sample % strata
+            if plain:
+                prices = _monthly_prices(volatility)
+                z = prices
+            else:
+                z = _normals(stratum, strata)
+                prices = _prices_of(z, volatility)
+
+            y, x = 0.0, 0.0
+            for leg in range(2 if antithetic else 1):
+                if leg == 1:
+                    prices = _prices_of(-z, volatility)
+
+                payoff, knocked_out = _accumulate_ko(prices, strike_price, knock_out_price)
+                if out.size > 0:
+                    out[i] = payoff
+                if knocked_out:
+                    knocked[w] += 1
+                for k in range(probs.size):
+                    _p2_update(q[k], pos[k], desired[k], incr[k], payoff, count)
+
+                count += 1
+                delta = payoff - mean[w]
+                mean[w] += delta / count
+                m2[w] += delta * (payoff - mean[w])
+
+                y += payoff
+                x += prices.sum()
+                i += 1
+
+            if antithetic:
+                y, x = y / 2, x / 2
+            _update_moments(moments[w, stratum], y, x)
+            sample += 1
+
+        if count > 0:
+            for k in range(probs.size):
+                quantiles[w, k] = _p2_estimate(probs[k], q[k], count)
+
+    return mean, m2, knocked, quantiles, moments
+
+
+@njit(cache=True)
+def _update_moments(m, y, x):
+    # m: count, mean of y, mean of x, M2 of y, M2 of x, co-moment
+    m[0] += 1
+    dy = y - m[1]
+    dx = x - m[2]
+    m[1] += dy / m[0]
+    m[2] += dx / m[0]
+    m[3] += dy * (y - m[1])
+    m[4] += dx * (x - m[2])
+    m[5] += dx * (y - m[1])
+
+
+def _merge_moments(a, b):
+    # Chan et al. pairwise combination of two (count, mean y, mean x, M2 y, M2 x, co-moment)
+    n = a[0] + b[0]
+    if a[0] == 0 or b[0] == 0:
+        return b.copy() if a[0] == 0 else a.copy()
+    dy = b[1] - a[1]
+    dx = b[2] - a[2]
+    w = a[0] * b[0] / n
+    return np.array([n,
+                     a[1] + dy * b[0] / n,
+                     a[2] + dx * b[0] / n,
+                     a[3] + b[3] + dy * dy * w,
+                     a[4] + b[4] + dx * dx * w,
+                     a[5] + b[5] + dx * dy * w])
+
+
+@njit(parallel=True, cache=True)
+def _normal_payoffs(z, strike_price, knock_out_price, volatility, payoffs, knocked):
+    # payoff of the path of every row of monthly standard normals
+    for i in prange(z.shape[0]):
+        payoffs[i], knocked[i] = _accumulate_ko(_prices_of(z[i], volatility), strike_price, knock_out_price)
+
+
+def _sobol_stats(times, strike_price, knock_out_price, volatility, seed, replications, bridge, out, workers):
+    if replications < 2 or times % replications != 0:
+        raise ValueError("times should split into 2 or more replications", times, replications)
+
+    # workers: threads of the payoff kernel, the result doesn't depend on them
+    threads = get_num_threads()
+    set_num_threads(min(workers, config.NUMBA_NUM_THREADS))
+    try:
+        return _sobol_replications(times, strike_price, knock_out_price, volatility, seed, replications, bridge, out)
+    finally:
+        set_num_threads(threads)
+
+
+def _sobol_replications(times, strike_price, knock_out_price, volatility, seed, replications, bridge, out):
+    total, mean, m2, knocked = 0, 0.0, 0.0, 0
+    means = []
+    for replication_seed in replication_seeds(seed, replications):
+        replication_sum = 0.0
+        for z in normal_blocks(times // replications, 12, 1 << 16, "sobol", replication_seed, bridge):
+            payoffs = np.empty(len(z))
+            knocked_out = np.empty(len(z), dtype=np.bool_)
+            _normal_payoffs(z, np.float32(strike_price), np.float32(knock_out_price), np.float32(volatility),
+                            payoffs, knocked_out)
+            if out.size > 0:
+                out[total:total + len(z)] = payoffs
+
+            # Chan et al. combination of the block with the previous ones
+            size = len(z)
+            block_mean = payoffs.mean()
+            delta = block_mean - mean
+            mean += delta * size / (total + size)
+            m2 += np.sum((payoffs - block_mean) ** 2) + delta ** 2 * total * size / (total + size)
+            total += size
+            replication_sum += payoffs.sum()
+            knocked += int(knocked_out.sum())
+        means.append(replication_sum / (times // replications))
+
+    variance = m2 / (total - 1)
+    stderr = np.std(means, ddof=1) / np.sqrt(replications)
+    return {"paths": total,
+            "mean": float(mean),
+            "variance": float(variance),
+            "stderr": float(stderr),
+            "variance_reduction": float(variance / total / stderr ** 2) if stderr > 0 else float("inf"),
+            "knock_out_freq": float(knocked / total),
+            "quantiles": {}}
+
+
+def shard_seeds(seed, workers):
+    # one independent stream per shard
+    return np.array([child.generate_state(1)[0] for child in np.random.SeedSequence(seed).spawn(workers)],
+                    dtype=np.uint32)
+
+
+def shard_offsets(times, workers):
+    # shard w simulates paths offsets[w]...offsets[w+1]-1
+    return np.linspace(0, times, workers + 1).astype(np.int64)
+
+
+def parallel_run(times, strike_price, knock_out_price, volatility, seed=1, workers=None):
+    """
+    Same contract as FastSimulation(times, strike_price, knock_out_price, volatility).run(), returned as a numpy array
+    workers: number of shards (default: numba threads), results are bit-identical for the same seed and workers
+    """
+    workers = get_num_threads() if workers is None else workers
+    if workers <= 0:
+        raise ValueError("workers should be positive", workers)
+
+    return _parallel_run(shard_seeds(seed, workers), shard_offsets(times, workers), np.float32(strike_price),
+                         np.float32(knock_out_price), np.float32(volatility))
+
+
 @jitclass(OrderedDict({
     'times': int32,
     'strike_price': float32,
@@ -45,27 +409,93 @@ class FastSimulation:
         np.random.seed(1)
         buyer_payoffs = []
         for i in range(self.times):
-            # generate 12 monthly returns from a normal distribution
-            # written this way as size parameter is not supported by numba
-            returns = [np.random.normal(
-                loc=0, scale=self.volatility)/100 + 1 for _ in range(12)]
-            # convert returns to a price array
-            prices = np.asarray(returns).cumprod() * 100
-            payoff = 0
-            for price in prices:
-                # the accumulator is terminated immediately
-                if price > self.knock_out_price:
-                    break
-                payoff += self.buyer_payoff(price)
-            buyer_payoffs.append(payoff)
+            prices = _monthly_prices(self.volatility)
+            buyer_payoffs.append(_accumulate(prices, self.strike_price, self.knock_out_price))
         return buyer_payoffs
 
     def buyer_payoff(self, share_price):
         "Buyer payoff conditional on the accumulator not terminated"
-        if share_price > self.knock_out_price:
-            return 0
-        payoff = 1000 * (share_price - self.strike_price)
-        if self.strike_price <= share_price <= self.knock_out_price:
-            return payoff
-        else:
-            return payoff * 2
\ No newline at end of file
+        return _buyer_payoff(share_price, self.strike_price, self.knock_out_price)
+
+
+def run_stats(times, strike_price, knock_out_price, volatility, seed=1, workers=None, quantiles=(), out=None,
+              antithetic=False, control=False, strata=1, generator="pseudo", replications=16, bridge=True):
+    """
+    Same paths as parallel_run(times, ..., seed, workers) without keeping the payoffs (unless variance reduction)
+    quantiles: probabilities in (0, 1), e.g. (0.01, 0.5, 0.99)
+    out: optional preallocated float64 array of size times to write the payoffs into
+    antithetic, control, strata: variance reduction, see above (times should be even with antithetic)
+    generator: "pseudo" or "sobol" (no quantiles nor variance reduction options, times / replications a power of 2)
+    workers: pseudo: shards (part of the seed), sobol: threads of the payoff kernel (capped by NUMBA_NUM_THREADS)
+    return: {"paths", "mean", "variance", "stderr", "variance_reduction", "knock_out_freq", "quantiles": {p: value}}
+            variance and quantiles are the ones of the payoff per path, mean and stderr the ones of the estimator
+    """
+    workers = get_num_threads() if workers is None else workers
+    if workers <= 0:
+        raise ValueError("workers should be positive", workers)
+    if times <= 0:
+        raise ValueError("times should be positive", times)
+    if antithetic and times % 2 != 0:
+        raise ValueError("times should be even for antithetic variates", times)
+    if strata <= 0:
+        raise ValueError("strata should be positive", strata)
+
+    probs = np.asarray(quantiles, dtype=np.float64).ravel()
+    if np.any((probs <= 0) | (probs >= 1)):
+        raise ValueError("quantiles should be in (0, 1)", quantiles)
+
+    if out is None:
+        out = np.empty(0)
+    elif out.shape != (times,) or out.dtype != np.float64:
+        raise ValueError("out should be a float64 array of size times", out.shape, out.dtype)
+
+    if generator == "sobol":
+        if probs.size > 0 or antithetic or control or strata != 1:
+            raise ValueError("quantiles and variance reduction are not supported by the sobol generator")
+        return _sobol_stats(times, strike_price, knock_out_price, volatility, seed, replications, bridge, out,
+                            workers)
+    elif generator != "pseudo":
+        raise ValueError("Invalid generator", generator)
+
+    # a shard owns whole antithetic pairs
+    offsets = 2 * shard_offsets(times // 2, workers) if antithetic else shard_offsets(times, workers)
+    if np.any(np.diff(offsets) < (4 if antithetic else 2) * strata):
+        raise ValueError("too few paths per shard for the number of strata", times, workers, strata)
+
+    mean, m2, knocked, shard_quantiles, moments = _parallel_stats(
+        shard_seeds(seed, workers), offsets, np.float32(strike_price), np.float32(knock_out_price),
+        np.float32(volatility), probs, out, antithetic, strata)
+
+    # Chan et al. pairwise combination of the shards
+    counts = np.diff(offsets)
+    total, total_mean, total_m2 = 0, 0.0, 0.0
+    for count, shard_mean, shard_m2 in zip(counts, mean, m2):
+        if count == 0:
+            continue
+        delta = shard_mean - total_mean
+        total_mean += delta * count / (total + count)
+        total_m2 += shard_m2 + delta ** 2 * total * count / (total + count)
+        total += count
+    variance = total_m2 / (total - 1) if total > 1 else 0.0
+
+    # per stratum: n, mean y, mean x, var y / n, var x / n, cov / n, weighted by stratum probability 1/strata
+    strata_moments = np.zeros((strata, 6))
+    for shard in moments:
+        for stratum in range(strata):
+            strata_moments[stratum] = _merge_moments(strata_moments[stratum], shard[stratum])
+    n, mean_y, mean_x, m2_y, m2_x, co = strata_moments.T
+    weight = 1.0 / strata
+    var_y, var_x, cov = [weight ** 2 * m / (n - 1) / n for m in (m2_y, m2_x, co)]
+
+    beta = cov.sum() / var_x.sum() if control and var_x.sum() > 0 else 0.0
+    estimate = np.sum(weight * (mean_y - beta * (mean_x - CONTROL_MEAN)))
+    stderr = np.sqrt(max(np.sum(var_y - 2 * beta * cov + beta ** 2 * var_x), 0.0))
+
+    return {"paths": int(total),
+            "mean": float(estimate),
+            "variance": float(variance),
+            "stderr": float(stderr),
+            "variance_reduction": float(variance / total / stderr ** 2) if stderr > 0 else float("inf"),
+            "knock_out_freq": float(knocked.sum() / total),
+            "quantiles": {float(p): float(np.average(shard_quantiles[:, k], weights=counts))
+                          for k, p in enumerate(probs)}}
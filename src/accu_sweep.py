@@ -0,0 +1,116 @@
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from numba import set_num_threads
+
+from src.accu_sim import run_stats
+
+"""
+Valuation of the accumulator over a grid of (K, k, sigma), i.e. strike price = 100 - K, knock-out price = 100 + k
+(see accu_sim), one run_stats() per cell.
+
+The cells are scheduled on a process pool. The numba kernels are compiled with cache=True, so every worker loads
+the same compiled code from the cache directory instead of compiling it again, and each worker is limited to
+threads numba threads so the pool doesn't oversubscribe the cores.
+
+Cell i is seeded with (seed, i): a cell has the same value whichever worker runs it and however often it's retried.
+A cell whose worker raises (or dies) is resubmitted up to retries times on a new pool; the ones still failing
+come back with ok=False and can be rerun alone with rerun_failed().
+"""
+
+SWEEP_DTYPE = np.dtype([('cell', np.int64),
+                        ('strike_offset', np.float64),
+                        ('knock_out_offset', np.float64),
+                        ('volatility', np.float64),
+                        ('value', np.float64),
+                        ('stderr', np.float64),
+                        ('variance_reduction', np.float64),
+                        ('knock_out_freq', np.float64),
+                        ('paths', np.int64),
+                        ('ok', np.bool_)])
+
+
+def grid(strike_offsets, knock_out_offsets, volatilities):
+    # every (K, k, sigma) combination as an empty result table
+    cells = list(itertools.product(strike_offsets, knock_out_offsets, volatilities))
+    result = np.zeros(len(cells), dtype=SWEEP_DTYPE)
+    result['cell'] = np.arange(len(cells))
+    if cells:
+        result['strike_offset'], result['knock_out_offset'], result['volatility'] = np.asarray(cells).T
+    result['value'] = np.nan
+    result['stderr'] = np.nan
+    result['variance_reduction'] = np.nan
+    result['knock_out_freq'] = np.nan
+    return result
+
+
+def sweep(strike_offsets, knock_out_offsets, volatilities, times=1000000, seed=1, processes=None, threads=1,
+          shards=1, retries=1, progress=None, as_frame=False, **variance_reduction):
+    """
+    processes: size of the process pool (default: number of cores), threads: numba threads per process
+    shards: run_stats workers per cell, i.e. part of the seed of the cell (see accu_sim.parallel_run)
+    variance_reduction: antithetic, control and strata of run_stats
+    progress: optional callable(done, total, row) called as each cell finishes (row['ok'] is False on failure)
+    return: structured array of SWEEP_DTYPE, or a pandas DataFrame when as_frame=True
+    """
+    result = grid(strike_offsets, knock_out_offsets, volatilities)
+    return rerun_failed(result, times, seed, processes, threads, shards, retries, progress, as_frame,
+                        **variance_reduction)
+
+
+def rerun_failed(result, times=1000000, seed=1, processes=None, threads=1, shards=1, retries=1, progress=None,
+                 as_frame=False, **variance_reduction):
+    # result: structured array of SWEEP_DTYPE, only the rows with ok=False are run
+    result = np.array(result, dtype=SWEEP_DTYPE)
+    pending = list(np.flatnonzero(~result['ok']))
+    done, total = 0, len(pending)
+
+    for attempt in range(retries + 1):
+        if not pending:
+            break
+
+        failed = []
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=_init_worker,
+                                 initargs=(threads,)) as executor:
+            futures = {executor.submit(_value_cell, times, (seed, int(result['cell'][i])), shards,
+                                       *result[['strike_offset', 'knock_out_offset', 'volatility']][i].tolist(),
+                                       **variance_reduction): i
+                       for i in pending}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    stats = future.result()
+                except Exception:
+                    failed.append(i)
+                    if attempt < retries:
+                        continue
+                else:
+                    result['value'][i] = stats["mean"]
+                    result['stderr'][i] = stats["stderr"]
+                    result['variance_reduction'][i] = stats["variance_reduction"]
+                    result['knock_out_freq'][i] = stats["knock_out_freq"]
+                    result['paths'][i] = stats["paths"]
+                    result['ok'][i] = True
+
+                done += 1
+                if progress is not None:
+                    progress(done, total, result[i])
+
+        pending = sorted(failed)
+
+    if as_frame:
+        import pandas as pd
+        return pd.DataFrame(result)
+    return result
+
+
+def _init_worker(threads):
+    set_num_threads(threads)
+
+
+def _value_cell(times, seed, shards, strike_offset, knock_out_offset, volatility, **variance_reduction):
+    return run_stats(times, 100 - strike_offset, 100 + knock_out_offset, volatility, seed=seed, workers=shards,
+                     **variance_reduction)
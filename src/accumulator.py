@@ -0,0 +1,154 @@
+import numpy as np
+
+from src.qmc import normal_blocks, replication_seeds
+
+"""
+Accumulator contracts beyond the fixed one of accu_sim: daily (or any number of) observations per settlement period,
+any number of settlements, share count, gearing and guaranteed periods.
+
+On every observation day t (before the knock-out):
+    shares(t) = shares                if strike <= S(t)
+              = shares * gearing      if S(t) < strike
+and the shares accumulated over a settlement period are bought at the strike at the end of the period:
+    payoff(period) = e^(-r * T(period)) * sum of shares(t) over the period * (S(T(period)) - strike)
+
+Knock-out: the contract terminates on the first observation day with S(t) > knock_out after the guaranteed periods
+(nothing accumulated from that day on), the shares accumulated before it in that period are still settled at the end
+of the period. During the guaranteed periods a price above knock_out doesn't terminate the contract.
+
+Prices follow a GBM with drift r, S(t+dt) = S(t) * e^((r - std^2/2)dt + std*sqrt(dt)*Z), simulated in blocks of
+(paths x observations) so the memory is bounded by block_size whatever the number of paths.
+
+With observations=1, r=0, shares=1000, gearing=2 and guaranteed=0, evaluate() is the payoff of accu_sim.FastSimulation
+for the same monthly prices.
+
+generator="sobol" draws the normals from scrambled Sobol points with Brownian bridge ordering (see qmc) instead, split
+into replications independent randomizations, and the stderr is the one of the mean over the replications.
+"""
+
+
+class AccumulatorContract:
+    def __init__(self, strike, knock_out, std, spot=100.0, r=0.0, tenor=1.0, settlements=12, observations=21,
+                 shares=1000, gearing=2.0, guaranteed=0):
+        """
+        std: annual volatility, r: annual drift and discount rate, tenor: in years
+        settlements: number of settlement periods, observations: observation days per settlement period
+        guaranteed: number of settlement periods without knock-out from the start
+        """
+        if not strike < knock_out:
+            raise ValueError("strike should be below the knock-out price", strike, knock_out)
+        if settlements <= 0 or observations <= 0:
+            raise ValueError("settlements and observations should be positive", settlements, observations)
+        if not 0 <= guaranteed <= settlements:
+            raise ValueError("guaranteed periods should be within the settlements", guaranteed, settlements)
+        if std <= 0 or tenor <= 0:
+            raise ValueError("std and tenor should be positive", std, tenor)
+
+        self.strike = strike
+        self.knock_out = knock_out
+        self.std = std
+        self.spot = spot
+        self.r = r
+        self.tenor = tenor
+        self.settlements = settlements
+        self.observations = observations
+        self.shares = shares
+        self.gearing = gearing
+        self.guaranteed = guaranteed
+
+        self.days = settlements * observations
+        self.dt = tenor / self.days
+        # settlement day of every period and its discount factor
+        self.settlement_days = np.arange(1, settlements + 1) * observations - 1
+        self.df = np.exp(-r * (self.settlement_days + 1) * self.dt)
+
+    def __str__(self):
+        return "Accumulator(strike = " + str(self.strike) + " , knock_out = " + str(self.knock_out) + \
+               " , std = " + str(self.std) + " , settlements = " + str(self.settlements) + \
+               " , observations = " + str(self.observations) + " , gearing = " + str(self.gearing) + \
+               " , guaranteed = " + str(self.guaranteed) + ")"
+
+
+def prices_from_normals(contract, z):
+    # z: (paths x days) standard normals -> (paths x days) prices, day 0 is the first observation after spot
+    drift = (contract.r - contract.std ** 2 / 2) * contract.dt
+    diffusion = contract.std * np.sqrt(contract.dt)
+    log_returns = drift + diffusion * z
+    np.cumsum(log_returns, axis=1, out=log_returns)
+    return contract.spot * np.exp(log_returns, out=log_returns)
+
+
+def evaluate(contract, prices):
+    """
+    prices: (paths x days) observed prices
+    return: (payoff per path, whether it's been knocked out)
+    """
+    days = np.arange(contract.days)
+    crossed = (prices > contract.knock_out) & (days >= contract.guaranteed * contract.observations)
+    knocked_out = crossed.any(axis=1)
+    # first knock-out day, or days if never
+    knock_out_day = np.where(knocked_out, crossed.argmax(axis=1), contract.days)
+
+    daily_shares = np.where(prices < contract.strike, contract.shares * contract.gearing, contract.shares)
+    daily_shares = np.where(days < knock_out_day[:, None], daily_shares, 0.0)
+
+    period_shares = daily_shares.reshape(len(prices), contract.settlements, contract.observations).sum(axis=2)
+    settlement_prices = prices[:, contract.settlement_days]
+    payoffs = (period_shares * (settlement_prices - contract.strike) * contract.df).sum(axis=1)
+    return payoffs, knocked_out
+
+
+def simulate(contract, paths, block_size=10000, seed=1, out=None, generator="pseudo", replications=16, bridge=True):
+    """
+    paths: number of paths, simulated block_size paths at a time (memory ~ block_size x days x a few float64)
+    out: optional preallocated float64 array of size paths to write the payoffs into
+    generator: "pseudo" or "sobol", replications: sobol only, paths / replications should be a power of 2
+    return: {"paths", "mean", "variance", "stderr", "knock_out_freq"}
+    """
+    if paths <= 0 or block_size <= 0:
+        raise ValueError("paths and block_size should be positive", paths, block_size)
+    if out is not None and (out.shape != (paths,) or out.dtype != np.float64):
+        raise ValueError("out should be a float64 array of size paths", out.shape, out.dtype)
+
+    if generator == "sobol":
+        if replications < 2 or paths % replications != 0:
+            raise ValueError("paths should split into 2 or more replications", paths, replications)
+        streams = [normal_blocks(paths // replications, contract.days, block_size, generator, s, bridge)
+                   for s in replication_seeds(seed, replications)]
+    else:
+        streams = [normal_blocks(paths, contract.days, block_size, generator, seed, bridge)]
+
+    total, mean, m2, knocked = 0, 0.0, 0.0, 0
+    stream_means = []
+    for stream in streams:
+        stream_total, stream_sum = 0, 0.0
+        for z in stream:
+            size = len(z)
+            payoffs, knocked_out = evaluate(contract, prices_from_normals(contract, z))
+            if out is not None:
+                out[total:total + size] = payoffs
+
+            # Chan et al. combination of the block with the previous ones
+            block_mean = payoffs.mean()
+            block_m2 = np.sum((payoffs - block_mean) ** 2)
+            delta = block_mean - mean
+            mean += delta * size / (total + size)
+            m2 += block_m2 + delta ** 2 * total * size / (total + size)
+            total += size
+            knocked += int(knocked_out.sum())
+
+            stream_total += size
+            stream_sum += payoffs.sum()
+        stream_means.append(stream_sum / stream_total)
+
+    variance = m2 / (total - 1) if total > 1 else 0.0
+    if generator == "sobol":
+        stderr = np.std(stream_means, ddof=1) / np.sqrt(len(stream_means))
+    else:
+        stderr = np.sqrt(variance / total)
+
+    return {"paths": total,
+            "mean": float(mean),
+            "variance": float(variance),
+            "stderr": float(stderr),
+            "knock_out_freq": knocked / total}
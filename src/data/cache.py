@@ -0,0 +1,128 @@
+import os
+from datetime import date, timedelta
+
+import numpy as np
+
+from src.data.model.daily_price import DailyPrice
+from src.data.store import PRICE_COLUMNS, column_dtype
+
+"""
+Read-through local cache of the DailyPrice history of tickers, so repeated backtests / vol estimations don't read the
+same partitions again and can run offline.
+
+Every ticker is a directory of one .npy file per column (date first), ascending by date, read memory-mapped. The
+high-water mark is the last cached date: an access only fetches the rows after it (Store.iter_daily_price_columns,
+ascending), appended to the files.
+
+Given the store, the cache listens to it: a row inserted, updated or deleted through the store at a date on or before
+the high-water mark drops the cached rows from that date on, so the next access fetches them again, once the batch
+has run for a batched write. Writes that don't go through a Store with this cache aren't seen, invalidate() them by
+hand.
+
+A file is replaced (written aside, then renamed), never modified in place, so the arrays already handed out stay
+valid. The columns of a ticker with different lengths (interrupted write) are treated as not cached.
+"""
+
+
+class PriceCache:
+    def __init__(self, directory, store=None, columns=PRICE_COLUMNS, origin=date(1970, 1, 1), fetch_size=5000):
+        """
+        store: Store to fetch from, None to work offline on what is cached
+        columns: cached numeric / date columns of DailyPrice, date is always cached
+        origin: first date fetched for a ticker not cached yet
+        """
+        names = ("date",) + tuple(name for name in columns if name != "date")
+        for name in names:
+            if name not in DailyPrice._columns or column_dtype(DailyPrice._columns[name]) == np.dtype("object"):
+                raise ValueError("Invalid column, only numeric and date columns can be memory-mapped", name)
+
+        self.directory = directory
+        self.store = store
+        self.columns = names
+        self.origin = origin
+        self.fetch_size = fetch_size
+        if store is not None:
+            store.add_listener(self.invalidate)
+
+    def _path(self, ticker, name):
+        if not ticker or os.sep in ticker or ticker.startswith("."):
+            raise ValueError("Invalid ticker", ticker)
+        return os.path.join(self.directory, ticker, name + ".npy")
+
+    def load(self, ticker):
+        # {column: read-only memory-mapped array} ascending by date, None if not cached
+        paths = [self._path(ticker, name) for name in self.columns]
+        if not all(os.path.exists(path) for path in paths):
+            return None
+
+        cached = {name: np.load(path, mmap_mode="r") for name, path in zip(self.columns, paths)}
+        if len(set(len(values) for values in cached.values())) != 1:
+            return None
+        return cached
+
+    def high_water(self, ticker):
+        # last cached date, None if nothing is cached
+        cached = self.load(ticker)
+        if cached is None or len(cached["date"]) == 0:
+            return None
+        return cached["date"][-1].item()
+
+    def refresh(self, ticker):
+        # fetches the rows after the high-water date, return: load(ticker)
+        if self.store is None:
+            raise ValueError("No store to refresh from", ticker)
+
+        cached = self.load(ticker)
+        last = self.high_water(ticker) if cached is not None else None
+        if last == date.max:
+            return cached
+        fromDate = self.origin if last is None else last + timedelta(days=1)
+
+        new = self.store.select_daily_price_columns(ticker, fromDate, date.max, columns=self.columns,
+                                                    fetch_size=self.fetch_size, ascending=True)
+        if cached is None:
+            self._write(ticker, new)
+        elif len(new["date"]) > 0:
+            self._write(ticker, {name: np.concatenate([cached[name], new[name]]) for name in self.columns})
+        return self.load(ticker)
+
+    def get(self, ticker, fromDate=None, toDate=None, exclude=False, refresh=True, as_frame=False):
+        """
+        Cached rows of the range, ascending by date, refreshed first unless offline or refresh=False
+        fromDate / toDate: None for no bound, exclude: toDate excluded (as Store.select_daily_price_by_range)
+        return: {column: read-only array}, or a pandas DataFrame when as_frame=True
+        """
+        if refresh and self.store is not None:
+            cached = self.refresh(ticker)
+        else:
+            cached = self.load(ticker)
+        if cached is None:
+            raise ValueError("Ticker not cached", ticker)
+
+        dates = cached["date"]
+        lo = 0 if fromDate is None else np.searchsorted(dates, np.datetime64(fromDate, "D"), side="left")
+        hi = len(dates) if toDate is None else \
+            np.searchsorted(dates, np.datetime64(toDate, "D"), side="left" if exclude else "right")
+        result = {name: cached[name][lo:hi] for name in self.columns}
+        if as_frame:
+            import pandas as pd
+            return pd.DataFrame(result)
+        return result
+
+    def invalidate(self, ticker, fromDate, toDate=None):
+        # drops the cached rows from fromDate on (Store listener, toDate unused)
+        cached = self.load(ticker)
+        if cached is None:
+            return
+
+        keep = np.searchsorted(cached["date"], np.datetime64(fromDate, "D"), side="left")
+        if keep < len(cached["date"]):
+            self._write(ticker, {name: np.array(cached[name][:keep]) for name in self.columns})
+
+    def _write(self, ticker, columns):
+        os.makedirs(os.path.join(self.directory, ticker), exist_ok=True)
+        for name in self.columns:
+            path = self._path(ticker, name)
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, np.ascontiguousarray(columns[name], dtype=column_dtype(DailyPrice._columns[name])))
+            os.replace(path + ".tmp", path)
@@ -37,3 +37,18 @@ class DailyPrice(Model):
     low = columns.Float()
     created_at = columns.DateTime()
     updated_at = columns.DateTime()
+
+
+class DailyPriceByYear(Model):
+    # DailyPrice partitioned by (ticker, year): a partition never grows past a year of rows
+    __table_name__ = 'DailyPriceByYear'
+    ticker = columns.Text(primary_key=True, partition_key=True)
+    year = columns.Integer(primary_key=True, partition_key=True)
+    date = columns.Date(primary_key=True, clustering_order="DESC")
+    name = columns.Text()
+    currency = columns.UserDefinedType(Currency)
+    close = columns.Float()
+    high = columns.Float()
+    low = columns.Float()
+    created_at = columns.DateTime()
+    updated_at = columns.DateTime()
@@ -5,32 +5,233 @@ from cassandra.cqlengine.columns import Text, UUID, Integer, UserDefinedType, Fl
 from cassandra.cqlengine.usertype import UserType
 from cassandra.policies import WhiteListRoundRobinPolicy, DowngradingConsistencyRetryPolicy, \
     ConstantSpeculativeExecutionPolicy
-from cassandra.query import named_tuple_factory
+from cassandra.query import named_tuple_factory, tuple_factory, BatchStatement, BatchType
+from cassandra.concurrent import execute_concurrent
 
 import uuid
+import weakref
+import numpy as np
 from cassandra.cqlengine import columns, ValidationError
 from cassandra.cqlengine import connection
 from cassandra.cqlengine.query import BatchQuery
+from collections import deque
 from datetime import datetime
+from time import time
 from cassandra.cqlengine.management import sync_table, drop_table
 from cassandra.cqlengine.models import Model
 
-from src.data.model.daily_price import DailyPrice, Currency
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from src.data.model.daily_price import DailyPrice, DailyPriceByYear, Currency
+
+
+def partition_batches(rows, batch_size, key=lambda row: row.ticker):
+    """
+    rows grouped by partition (key of the row, ticker by default), in input order, and split into chunks of at most
+    batch_size rows: a batch never spans partitions, so an unlogged batch is a single mutation on one replica set
+    """
+    if batch_size <= 0:
+        raise ValueError("batch_size should be positive", batch_size)
+
+    partitions = {}
+    for row in rows:
+        partitions.setdefault(key(row), []).append(row)
+
+    return [partition[i:i + batch_size] for partition in partitions.values()
+            for i in range(0, len(partition), batch_size)]
+
+
+class BatchError(Exception):
+    # errors: [(ticker, exception)] of what still failed after the retries
+    def __init__(self, message, errors):
+        super().__init__(message, errors)
+        self.errors = errors
+
+
+# execution profile of the raw tuple rows, the default one is cqlengine's (dict rows)
+COLUMNAR_PROFILE = "columnar"
+PRICE_COLUMNS = ("date", "close", "high", "low")
+
+
+def column_dtype(column):
+    # numpy dtype of a cqlengine column
+    if isinstance(column, columns.Date):
+        return np.dtype("datetime64[D]")
+    if isinstance(column, columns.DateTime):
+        return np.dtype("datetime64[ms]")
+    if isinstance(column, (columns.Float, columns.Double, columns.Decimal)):
+        return np.dtype("float64")
+    if isinstance(column, (columns.Integer, columns.BigInt, columns.SmallInt, columns.TinyInt)):
+        return np.dtype("int64")
+    return np.dtype("object")
+
+
+def to_columns(rows, names, dtypes):
+    """
+    rows: tuples of the values of names (tuple_factory), dtypes: numpy dtype per name
+    return: {name: contiguous array}, a missing value is NaN / NaT (None for object columns)
+    """
+    values = list(zip(*rows)) if rows else [()] * len(names)
+    result = {}
+    for name, dtype, column in zip(names, dtypes, values):
+        if dtype == np.dtype("datetime64[D]"):
+            # cassandra.util.Date, days since the epoch
+            result[name] = np.array([np.iinfo(np.int64).min if d is None else d.days_from_epoch for d in column],
+                                    dtype=np.int64).view(dtype)
+        elif dtype == np.dtype("float64"):
+            result[name] = np.array([np.nan if v is None else v for v in column], dtype=dtype)
+        elif dtype == np.dtype("int64") and None in column:
+            result[name] = np.array([np.nan if v is None else v for v in column], dtype=np.float64)
+        else:
+            result[name] = np.array(column, dtype=dtype)
+    return result
+
+
+def year_buckets(fromDate, toDate, ascending=False, first=None, last=None):
+    # years of the (ticker, year) partitions of a date range within the years first...last, in date order
+    years = list(range(fromDate.year if first is None else max(fromDate.year, first),
+                       (toDate.year if last is None else min(toDate.year, last)) + 1))
+    return years if ascending else years[::-1]
+
+
+def execute_with_retries(execute, statements, retries):
+    """
+    execute: callable(list of (statement, parameters)) -> list of (success, result_or_exc) in the same order,
+    e.g. execute_concurrent(session, ..., raise_on_first_error=False)
+    return: {index of the statement: last exception} of the ones still failing after retries
+    """
+    errors = {}
+    pending = list(range(len(statements)))
+    for attempt in range(retries + 1):
+        if not pending:
+            break
+
+        failed = []
+        for i, (success, result) in zip(pending, execute([statements[i] for i in pending])):
+            if success:
+                errors.pop(i, None)
+            else:
+                errors[i] = result
+                failed.append(i)
+        pending = failed
+
+    return errors
 
 
 class Store:
-    def __init__(self, hosts, keyspace):
-        connection.setup(hosts=hosts, default_keyspace=keyspace, protocol_version=3)
-        sync_table(DailyPrice)
+    # {key}: the partition key, ticker or ticker and year (bucketed)
+    INSERT_DAILY_PRICE = "INSERT INTO {table} (ticker, date, year, name, currency, close, high, low, created_at, " \
+                         "updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    # one range tombstone per partition
+    DELETE_DAILY_PRICE_RANGE = "DELETE FROM {table} WHERE {key} AND date >= ? AND date <= ?"
+    DELETE_DAILY_PRICE_RANGE_EXCLUDE = "DELETE FROM {table} WHERE {key} AND date >= ? AND date < ?"
+    # dates per UPDATE ... WHERE date IN, bounds the work of the coordinator
+    MAX_IN = 100
+
+    # default years of the partitions of a bucketed store, the current year at most
+    FIRST_YEAR = 1900
+
+    def __init__(self, hosts, keyspace, bucketed=False, workers=8, years=None):
+        """
+        bucketed: DailyPriceByYear, partitioned by (ticker, year), instead of DailyPrice. A range is then one query per
+        year, at most workers of them in flight, merged in date order
+        years: (first, last) years that can hold rows of a bucketed store, the range of a query is clipped to them,
+        (FIRST_YEAR, current year) by default, last None for the current year
+        """
+        connection.setup(hosts=hosts, default_keyspace=keyspace, protocol_version=3,
+                         execution_profiles={EXEC_PROFILE_DEFAULT: ExecutionProfile(),
+                                             COLUMNAR_PROFILE: ExecutionProfile(row_factory=tuple_factory)})
+        self.bucketed = bucketed
+        self.model = DailyPriceByYear if bucketed else DailyPrice
+        self.key_columns = ("ticker", "year") if bucketed else ("ticker",)
+        self.workers = workers
+        self.years = (self.FIRST_YEAR, None) if years is None else years
+        sync_table(self.model)
+        self.keyspace = keyspace
+        self._prepared = {}
+        # callables (ticker, fromDate, toDate) told of the rows written or deleted, e.g. PriceCache.invalidate
+        self.listeners = []
+        # {BatchQuery: {ticker: (fromDate, toDate)}} of the changes told once the batch has run
+        self._batched = weakref.WeakKeyDictionary()
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def _changed(self, ticker, fromDate, toDate, batch=None):
+        # listeners told now, or with a batch: once per ticker (range of its rows) after the batch has run
+        if batch is None:
+            for listener in self.listeners:
+                listener(ticker, fromDate, toDate)
+            return
+        if not self.listeners:
+            return
+
+        ranges = self._batched.get(batch)
+        if ranges is None:
+            ranges = self._batched[batch] = {}
+            batch.add_callback(self._batch_executed, ranges)
+        if ticker in ranges:
+            lo, hi = ranges[ticker]
+            ranges[ticker] = (min(lo, fromDate), max(hi, toDate))
+        else:
+            ranges[ticker] = (fromDate, toDate)
+
+    def _batch_executed(self, ranges):
+        for ticker, (fromDate, toDate) in ranges.items():
+            self._changed(ticker, fromDate, toDate)
+
+    def _partitions(self, ticker, fromDate, toDate, ascending=False):
+        # partition keys of a range, in date order
+        if self.bucketed:
+            first, last = self.years
+            last = datetime.now().year if last is None else last
+            return [(ticker, year) for year in year_buckets(fromDate, toDate, ascending, first, last)]
+        return [(ticker,)]
+
+    def _partition_of(self, ticker, date):
+        return (ticker, date.year) if self.bucketed else (ticker,)
+
+    def _fan_out(self, query, keys):
+        # query(key) of every partition, at most workers at a time, in the order of keys
+        if len(keys) <= 1:
+            return [query(key) for key in keys]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(query, keys))
+
+    def _range_query(self, key, fromDate, toDate, exclude=False):
+        q = self.model.objects.filter(**dict(zip(self.key_columns, key))) \
+            .filter(self.model.date >= fromDate)
+        if exclude:
+            return q.filter(self.model.date < toDate)
+        else:
+            return q.filter(self.model.date <= toDate)
+
+    @property
+    def session(self):
+        # the session of the cqlengine connection
+        return connection.get_session()
+
+    def prepare(self, cql):
+        # prepared once per statement
+        if cql not in self._prepared:
+            key = " AND ".join(name + " = ?" for name in self.key_columns)
+            self._prepared[cql] = self.session.prepare(cql.format(table=self.model.column_family_name(), key=key))
+        return self._prepared[cql]
+
+    def execute_concurrent(self, statements, concurrency=64, retries=3):
+        # statements: list of (statement, parameters), at most concurrency requests in flight
+        return execute_with_retries(lambda pending: execute_concurrent(self.session, pending, concurrency=concurrency,
+                                                                       raise_on_first_error=False),
+                                    statements, retries)
 
     def drop_daily_price_table(self):
-        drop_table(DailyPrice)
+        drop_table(self.model)
 
     def insert_daily_price(self, ticker, date, name, ccy, country, close, high, low, created_at=None, batch=None):
         if created_at is None:
             created_at = datetime.now()
 
-        DailyPrice.batch(batch).create(ticker=ticker,
+        self.model.batch(batch).create(ticker=ticker,
                                        year=date.year,
                                        date=date,
                                        name=name,
@@ -40,6 +241,7 @@ class Store:
                                        low=float(low),
                                        created_at=created_at,
                                        updated_at=created_at)
+        self._changed(ticker, date, date, batch)
 
     def batch_insert_daily_price(self, dailyprices, execute_on_exception=False):
         with BatchQuery(execute_on_exception=execute_on_exception) as b:
@@ -57,19 +259,87 @@ class Store:
                                         batch=b
                                         )
 
-    def batch_delete_daily_price(self, dailyprice_ranges, execute_on_exception=False):
-        with BatchQuery(execute_on_exception=execute_on_exception) as b:
+    def bulk_insert_daily_price(self, dailyprices, batch_size=50, concurrency=64, retries=3, created_at=None):
+        """
+        High-throughput load: prepared INSERT, one unlogged batch per partition chunk of batch_size rows,
+        concurrency batches in flight, failed batches retried up to retries times
+        dailyprices: rows with ticker, date, name, ccy, country, close, high, low (as batch_insert_daily_price)
+        return: {"rows", "batches", "failed_rows", "errors", "seconds", "rows_per_sec"}
+        """
+        if created_at is None:
+            created_at = datetime.now()
+
+        return self.bulk_insert_values([(row.ticker, row.date, row.date.year, row.name, (row.ccy, row.country),
+                                         float(row.close), float(row.high), float(row.low), created_at, created_at)
+                                        for row in dailyprices], batch_size, concurrency, retries)
+
+    def bulk_insert_values(self, values, batch_size=50, concurrency=64, retries=3):
+        """
+        bulk_insert_daily_price of the values of INSERT_DAILY_PRICE: (ticker, date, year, name, (ccy, country),
+        close, high, low, created_at, updated_at)
+        """
+        ts = time()
+        insert = self.prepare(self.INSERT_DAILY_PRICE)
+        chunks = partition_batches(values, batch_size, key=lambda value: self._partition_of(value[0], value[1]))
+        statements = []
+        for chunk in chunks:
+            batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+            for value in chunk:
+                batch.add(insert, value)
+            statements.append((batch, None))
+
+        errors = self.execute_concurrent(statements, concurrency, retries)
+        te = time()
+        for chunk in chunks:
+            dates = [value[1] for value in chunk]
+            self._changed(chunk[0][0], min(dates), max(dates))
+
+        rows = sum(len(chunk) for chunk in chunks)
+        failed_rows = sum(len(chunks[i]) for i in errors)
+        return {"rows": rows,
+                "batches": len(chunks),
+                "failed_rows": failed_rows,
+                "errors": [(chunks[i][0][0], error) for i, error in sorted(errors.items())],
+                "seconds": te - ts,
+                "rows_per_sec": (rows - failed_rows) / (te - ts) if te > ts else float("inf")}
+
+    def batch_delete_daily_price(self, dailyprice_ranges, execute_on_exception=False, concurrency=64, retries=3,
+                                 return_errors=False):
+        """
+        One prepared range DELETE per item and partition, concurrency of them in flight, failed ones retried up to
+        retries times (a range delete is idempotent)
+        execute_on_exception: as BatchQuery, the deletes built before an exception in dailyprice_ranges still run
+        return_errors: return [(ticker, exception)] of the ranges still failing instead of raising a BatchError
+        """
+        ranges, statements = [], []
+        try:
             for dailyprice_range in dailyprice_ranges:
                 exclude = False
                 if hasattr(dailyprice_range, 'exclude'):
                     exclude = dailyprice_range.exclude
 
-                self.delete_daily_price(ticker=dailyprice_range.ticker,
-                                        fromDate=dailyprice_range.fromDate,
-                                        toDate=dailyprice_range.toDate,
-                                        exclude=exclude,
-                                        batch=b
-                                        )
+                delete = self.prepare(self.DELETE_DAILY_PRICE_RANGE_EXCLUDE if exclude
+                                      else self.DELETE_DAILY_PRICE_RANGE)
+                ticker, fromDate, toDate = dailyprice_range.ticker, dailyprice_range.fromDate, dailyprice_range.toDate
+                for key in self._partitions(ticker, fromDate, toDate):
+                    statements.append((delete, key + (fromDate, toDate)))
+                ranges.append((ticker, fromDate, toDate))
+        except Exception:
+            if execute_on_exception:
+                self._delete_ranges(ranges, statements, concurrency, retries)
+            raise
+
+        errors = self._delete_ranges(ranges, statements, concurrency, retries)
+        if return_errors:
+            return errors
+        if errors:
+            raise BatchError("range deletes failed after retries", errors)
+
+    def _delete_ranges(self, ranges, statements, concurrency, retries):
+        errors = self.execute_concurrent(statements, concurrency, retries)
+        for ticker, fromDate, toDate in ranges:
+            self._changed(ticker, fromDate, toDate)
+        return [(statements[i][1][0], error) for i, error in sorted(errors.items())]
 
     def batch_update_daily_price(self, dailyprice_updates, execute_on_exception=False):
         with BatchQuery(execute_on_exception=execute_on_exception) as b:
@@ -79,17 +349,35 @@ class Store:
                 exclude = False
                 if hasattr(dailyprice_update, 'exclude'):
                     exclude = dailyprice_update.exclude
+                dates = None
+                if hasattr(dailyprice_update, 'dates'):
+                    dates = dailyprice_update.dates
                 self.update_daily_price(ticker=dailyprice_update.ticker,
                                         fromDate=dailyprice_update.fromDate,
                                         toDate=dailyprice_update.toDate,
                                         exclude=exclude,
                                         batch=b,
+                                        dates=dates,
                                         **dailyprice_update.kwargs)
 
-    def update_daily_price(self, ticker, fromDate, toDate, exclude=False, batch=None, **kwargs):
-        rows = self.select_daily_price_by_range(ticker, fromDate, toDate, exclude)
-        for row in rows:
-            row.batch(batch).update(**kwargs)
+    def update_daily_price(self, ticker, fromDate, toDate, exclude=False, batch=None, dates=None, **kwargs):
+        """
+        Writes by primary key: UPDATE ... WHERE <partition> AND date IN (...), MAX_IN dates per statement
+        dates: the dates of the rows to update, if None the dates of the range are read first (clustering keys only),
+        an UPDATE on a missing date would insert the row. The dates out of the range are left out, a None fromDate /
+        toDate doesn't bound it
+        """
+        if dates is None:
+            dates = self.select_daily_price_dates(ticker, fromDate, toDate, exclude)
+
+        dates = [date for date in dates if (fromDate is None or date >= fromDate)
+                 and (toDate is None or (date < toDate if exclude else date <= toDate))]
+        partitions = partition_batches(dates, self.MAX_IN, key=lambda date: self._partition_of(ticker, date))
+        for chunk in partitions:
+            key = dict(zip(self.key_columns, self._partition_of(ticker, chunk[0])))
+            self.model.objects.filter(date__in=chunk, **key).batch(batch).update(**kwargs)
+        if dates:
+            self._changed(ticker, min(dates), max(dates), batch)
 
     def save(self, model):
         if model is not None and isinstance(model, cassandra.cqlengine.models.Model):
@@ -98,12 +386,134 @@ class Store:
         model.save()
 
     def delete_daily_price(self, ticker, fromDate, toDate, exclude=False, batch=None):
-        return self.select_daily_price_by_range(ticker, fromDate, toDate, exclude).batch(batch).delete()
+        # a single DELETE on the clustering range of every partition, nothing is read
+        for key in self._partitions(ticker, fromDate, toDate):
+            self._range_query(key, fromDate, toDate, exclude).batch(batch).delete()
+        self._changed(ticker, fromDate, toDate, batch)
 
     def select_daily_price_by_range(self, ticker, fromDate, toDate, exclude=False):
-        q = DailyPrice.objects.filter(ticker=ticker) \
-            .filter(DailyPrice.date >= fromDate)
+        """
+        return: a queryset of the range, bucketed: over its years (year IN ...), in partition then date order,
+        select_daily_price_rows for the rows in date order
+        """
+        if not self.bucketed:
+            return self._range_query((ticker,), fromDate, toDate, exclude)
+
+        years = [year for ticker, year in self._partitions(ticker, fromDate, toDate)]
+        q = self.model.objects.filter(ticker=ticker, year__in=years) \
+            .filter(self.model.date >= fromDate)
         if exclude:
-            return q.filter(DailyPrice.date < toDate)
+            return q.filter(self.model.date < toDate)
         else:
-            return q.filter(DailyPrice.date <= toDate)
+            return q.filter(self.model.date <= toDate)
+
+    def select_daily_price_rows(self, ticker, fromDate, toDate, exclude=False):
+        # list of all the rows of the range in date order (DESC), bucketed: from the concurrent queries of its years
+        partitions = self._fan_out(lambda key: list(self._range_query(key, fromDate, toDate, exclude).limit(None)),
+                                   self._partitions(ticker, fromDate, toDate))
+        return [row for rows in partitions for row in rows]
+
+    def select_daily_price_dates(self, ticker, fromDate, toDate, exclude=False):
+        # dates only of all the rows of the range (no queryset default limit), DESC
+        years = self._fan_out(lambda key: list(self._range_query(key, fromDate, toDate, exclude).limit(None)
+                                               .values_list('date', flat=True)),
+                              self._partitions(ticker, fromDate, toDate))
+        return [date for dates in years for date in dates]
+
+    def iter_daily_price_columns(self, ticker, fromDate, toDate, exclude=False, columns=PRICE_COLUMNS,
+                                 fetch_size=5000, ascending=False, in_flight=None):
+        """
+        Columnar read of a range without model objects: yields {column: array} per page of fetch_size rows
+        columns: projection, any columns of DailyPrice but the currency UDT
+        ascending: by date, the table order (DESC) otherwise
+        in_flight: bucketed, at most in_flight (workers by default) years requested at a time, the first pages of the
+        next years are requested while the pages of the current one are read
+        """
+        names = tuple(columns)
+        for name in names:
+            if name not in self.model._columns or isinstance(self.model._columns[name], UserDefinedType):
+                raise ValueError("Invalid column", name)
+        if fetch_size <= 0:
+            raise ValueError("fetch_size should be positive", fetch_size)
+
+        dtypes = [column_dtype(self.model._columns[name]) for name in names]
+        cql = "SELECT " + ", ".join(names) + " FROM {table} WHERE {key} AND date >= ? AND date " + \
+              ("< ?" if exclude else "<= ?") + (" ORDER BY date ASC" if ascending else "")
+        in_flight = self.workers if in_flight is None else in_flight
+        if in_flight <= 0:
+            raise ValueError("in_flight should be positive", in_flight)
+
+        def request(key):
+            statement = self.prepare(cql).bind(key + (fromDate, toDate))
+            statement.fetch_size = fetch_size
+            return self.session.execute_async(statement, execution_profile=COLUMNAR_PROFILE)
+
+        keys = deque(self._partitions(ticker, fromDate, toDate, ascending))
+        if not keys:
+            yield to_columns([], names, dtypes)
+        futures = deque(request(keys.popleft()) for _ in range(min(in_flight, len(keys))))
+        while futures:
+            result = futures.popleft().result()
+            while True:
+                yield to_columns(result.current_rows, names, dtypes)
+                if not result.has_more_pages:
+                    break
+                result.fetch_next_page()
+            # the current year is done, one more in flight
+            if keys:
+                futures.append(request(keys.popleft()))
+
+    def select_daily_price_columns(self, ticker, fromDate, toDate, exclude=False, columns=PRICE_COLUMNS,
+                                   fetch_size=5000, ascending=False, as_frame=False, in_flight=None):
+        """
+        The pages of iter_daily_price_columns concatenated
+        return: {column: array}, or a pandas DataFrame when as_frame=True
+        """
+        pages = list(self.iter_daily_price_columns(ticker, fromDate, toDate, exclude, columns, fetch_size, ascending,
+                                                   in_flight))
+        result = {name: np.concatenate([page[name] for page in pages]) for name in columns}
+        if as_frame:
+            import pandas as pd
+            return pd.DataFrame(result)
+        return result
+
+    def iter_daily_price_universe(self, tickers, fromDate, toDate, exclude=False, columns=PRICE_COLUMNS,
+                                  fetch_size=5000, ascending=False, as_frame=False, concurrency=32):
+        """
+        select_daily_price_columns of many tickers, at most concurrency of them in flight: a ticker reads its
+        partitions (years when bucketed) one at a time, so at most concurrency partition requests are in flight
+        yields (ticker, result, None) or (ticker, None, exception) as the tickers complete, an error only fails its
+        ticker. Leaving the loop early cancels the tickers not started
+        """
+        if concurrency <= 0:
+            raise ValueError("concurrency should be positive", concurrency)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {executor.submit(self.select_daily_price_columns, ticker, fromDate, toDate, exclude, columns,
+                                       fetch_size, ascending, as_frame, 1): ticker for ticker in tickers}
+            try:
+                for future in as_completed(futures):
+                    error = future.exception()
+                    yield futures[future], None if error is not None else future.result(), error
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def select_daily_price_universe(self, tickers, fromDate, toDate, exclude=False, columns=PRICE_COLUMNS,
+                                    fetch_size=5000, ascending=False, as_frame=False, concurrency=32):
+        """
+        iter_daily_price_universe collected
+        return: ({ticker: result}, {ticker: exception}) in the order of tickers
+        """
+        tickers = list(tickers)
+        results, errors = {}, {}
+        for ticker, result, error in self.iter_daily_price_universe(tickers, fromDate, toDate, exclude, columns,
+                                                                    fetch_size, ascending, as_frame, concurrency):
+            if error is not None:
+                errors[ticker] = error
+            else:
+                results[ticker] = result
+
+        order = {ticker: i for i, ticker in enumerate(tickers)}
+        return dict(sorted(results.items(), key=lambda item: order[item[0]])), \
+            dict(sorted(errors.items(), key=lambda item: order[item[0]]))
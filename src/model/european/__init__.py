@@ -13,3 +13,23 @@ def logger(f):
         return result
 
     return wrapper
+
+
+def cached(f):
+    # opt-in: self.cache is a PricingCache or None
+    @wraps(f)
+    def wrapper(self, initSpot, noShares=100, *args, **kw):
+        if self.cache is None:
+            return f(self, initSpot, noShares, *args, **kw)
+
+        initSpot = self.cache.quantize(initSpot)
+        key = self._cache_key(f.__name__, initSpot, noShares, extra=(args, tuple(sorted(kw.items()))))
+        result = self.cache.get(key)
+        if result is None:
+            result = f(self, initSpot, noShares, *args, **kw)
+            self.cache.put(key, result)
+
+        # greeks: don't hand out the cached dict
+        return dict(result) if isinstance(result, dict) else result
+
+    return wrapper
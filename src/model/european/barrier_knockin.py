@@ -1,18 +1,21 @@
 import numpy as np
 
-from src.model.european import logger
+from src.model.european import kernels, barrier_analytic
+from src.model.european.barrier_knockout import layered_price
 from src.model.european.vanilla import Vanilla
 
 
 class KnockInOptions(Vanilla):
-    def __init__(self, name, r, std, tenor, n, strike, opt, barrier, move):
-        super().__init__(name, r, std, tenor, n, strike, opt)
+    def __init__(self, name, r, std, tenor, n, strike, opt, barrier, move, fast=False, model="CRR", engine=None,
+                 convergence=None, cache=None):
+        super().__init__(name, r, std, tenor, n, strike, opt, fast, model, engine, convergence, cache)
         self.barrier = barrier
         self.move = move
 
-        # check if terminated
-        self._isActivated = lambda spot: (self.move == "up" and self.compare_float(spot, self.barrier) >= 0) \
-                                         or (self.move == "down" and self.compare_float(spot, self.barrier) <= 0)
+    def _isActivated(self, spot):
+        # check if activated (a method, so a _bumped barrier is seen)
+        return (self.move == "up" and self.compare_float(spot, self.barrier) >= 0) \
+            or (self.move == "down" and self.compare_float(spot, self.barrier) <= 0)
 
     def _dfs(self, initSpot, i, j, vanilla, memo):
         if i > self.n:
@@ -31,17 +34,46 @@ class KnockInOptions(Vanilla):
 
         return memo[i][j]
 
+    def _engine_price(self, initSpot, noShares=100, top=None):
+        if self.model == "BS":
+            return self._bs_price(initSpot, noShares)
+        elif self.engine == "numba":
+            return self._numba_price(initSpot, noShares, top)
+        elif self.engine == "fast":
+            return self._fast_price(initSpot, noShares, top)
+        else:
+            return self._slow_price(initSpot, noShares, top)
+
+    def _numba_price(self, initSpot, noShares=100, top=None):
+        self.check_precision()
+        vleaf = self._numba_leaf(initSpot, noShares)
+        leaf = vleaf - self._numba_leaf(initSpot, noShares, *self._alive())
+        return kernels.knockin_price(*self._numba_args(initSpot, noShares), float(self.barrier), self.move == "up",
+                                     self._top(top), vleaf, leaf)
+
     """
     1. Vanilla 2D numpy Array + DFS with memo
       * Time complexity: N^2 
       * Space complexity: N^2
     """
 
-    @logger
-    def price(self, initSpot, noShares=100):
+    def _slow_price(self, initSpot, noShares=100, top=None):
         memo = np.full((self.n + 1, self.n + 1), -1.0, dtype=np.longdouble)
         vanilla = super()._vanilla(initSpot, noShares)
-        return self._dfs(initSpot, 0, 0, vanilla, memo)
+        start = self._start()
+        if start < self.n:
+            # BS PV over the last period at PV(n-1), the DFS stops there
+            S = self.S(initSpot, totalDown=start)
+            memo[start][:start + 1] = np.where(self._is_all_activated(S), vanilla[start][:start + 1],
+                                               vanilla[start][:start + 1]
+                                               - self._leaf(S, noShares, None, *self._alive()))
+        pv = self._dfs(initSpot, 0, 0, vanilla, memo)
+        if top is not None:
+            # PV(i,j) at period 1 and 2, already in memo unless activated
+            for i in range(3):
+                for j in range(i + 1):
+                    top[i][j] = self._dfs(initSpot, i, j, vanilla, memo)
+        return pv
 
     """
     2. Vanilla 2D numpy Array + Top-Down to de-/activate contract + Bottom-UP to reprice
@@ -85,9 +117,101 @@ knock_out_pv+knock_in_pv =  13.683628262946256 , vanilla_pv =  13.52478267498593
     #
     #     return pv[0][0]
 
-    # TODO: Approach 3
     """
     3. Bottom-up DP to calculate (1) activated node(i,j)'s vanilla price Or (2) if not activated, do as usual 
-      * Time complexity: K x N^2
-      * Space complexity: N (reuse the same maximum array)
+      * Time complexity: N^2 (vanilla and knock-in are inducted side by side)
+      * Space complexity: N (two 1D buffers: vanilla PV and knock-in PV)
     """
+
+    def _fast_price(self, initSpot, noShares=100, top=None):
+        if self.model == "BS":
+            raise ValueError("Invalid Model for fast version", self.model)
+
+        # S: size=start+1
+        start = self._start()
+        S = self.S(initSpot, totalDown=start)
+
+        # initialize vanilla PV(1D array): size=start+1
+        VPV = self._leaf(S, noShares)
+
+        # knock-in PV: vanilla less what pays off without activation (only activated leaves pay off at period n)
+        PV = np.where(self._is_all_activated(S), VPV, VPV - self._leaf(S, noShares, None, *self._alive()))
+        self._capture(top, start, PV)
+
+        # start-1...0
+        for i in reversed(range(start)):
+            # no new copy
+            # assign result to the view of VPV and PV
+            VPV[:i + 1] = self.df * (self.pu * VPV[1:i + 2] + self.pd * VPV[0:i + 1])
+            PV[:i + 1] = self.df * (self.pu * PV[1:i + 2] + self.pd * PV[0:i + 1])
+            # shrink
+            VPV = VPV[:-1]
+            PV = PV[:-1]
+            # PV: new size = i
+            S = self.S(initSpot, totalDown=i)
+            # becomes vanilla options at activated (i,j)
+            activated = self._is_all_activated(S)
+            PV[activated] = VPV[activated]
+            self._capture(top, i, PV)
+
+        return PV[0]
+
+    def _alive(self, barrier=None):
+        # range of S(n) where the contract pays off without activation: (lower, upper)
+        if barrier is None:
+            barrier = self.barrier
+
+        if self.move == "up":
+            return 0.0, barrier
+        return barrier, np.inf
+
+    def _is_all_activated(self, S, barrier=None):
+        if barrier is None:
+            barrier = self.barrier
+
+        return ((self.move == "up") & self.is_all_float_ge(S, barrier)) \
+               | ((self.move == "down") & self.is_all_float_le(S, barrier))
+
+    def _bs_price(self, initSpot, noShares=100):
+        # continuous barrier (closed form)
+        return float(barrier_analytic.price(initSpot=initSpot, strike=self.strike, barrier=self.barrier, r=self.r,
+                                            std=self.std, tenor=self.tenor, opt=self.opt, move=self.move,
+                                            inout="in", noShares=noShares))
+
+    def _bs_greeks(self, initSpot, noShares=100):
+        return self._bump_greeks(initSpot, noShares)
+
+    def _bump_price(self, initSpot, noShares=100):
+        return layered_price(self, initSpot, noShares)
+
+    def price_strikes(self, initSpot, strikes, barriers=None, noShares=100):
+        strikes = np.asarray(strikes, dtype=np.float64)
+        # one barrier per strike (default: the contract barrier for all of them)
+        barriers = np.broadcast_to(self.barrier if barriers is None else np.asarray(barriers, dtype=np.float64),
+                                   strikes.shape)
+        if self.model == "BS":
+            return barrier_analytic.price(initSpot=initSpot, strike=strikes, barrier=barriers, r=self.r,
+                                          std=self.std, tenor=self.tenor, opt=self.opt, move=self.move,
+                                          inout="in", noShares=noShares)
+
+        return self._extrapolate(lambda lattice: lattice._ladder(initSpot, strikes, barriers[:, np.newaxis], noShares))
+
+    def _ladder(self, initSpot, strikes, barriers, noShares=100):
+        # vanilla and knock-in PV(2D arrays): size=K x (start+1)
+        start = self._start()
+        S = self.S(initSpot, totalDown=start)
+        VPV = self._leaf(S[np.newaxis, :], noShares, strikes[:, np.newaxis])
+        PV = np.where(self._is_all_activated(S[np.newaxis, :], barriers), VPV,
+                      VPV - self._leaf(S[np.newaxis, :], noShares, strikes[:, np.newaxis], *self._alive(barriers)))
+
+        # start-1...0
+        for i in reversed(range(start)):
+            VPV[:, :i + 1] = self.df * (self.pu * VPV[:, 1:i + 2] + self.pd * VPV[:, 0:i + 1])
+            PV[:, :i + 1] = self.df * (self.pu * PV[:, 1:i + 2] + self.pd * PV[:, 0:i + 1])
+            VPV = VPV[:, :-1]
+            PV = PV[:, :-1]
+            S = self.S(initSpot, totalDown=i)
+            activated = self._is_all_activated(S[np.newaxis, :], barriers)
+            PV[activated] = VPV[activated]
+
+        return PV[:, 0]
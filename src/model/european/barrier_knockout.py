@@ -1,82 +1,175 @@
 import numpy as np
 
-from src.model.european import logger
+from src.model.european import kernels, barrier_analytic
 from src.model.european.vanilla import Vanilla
 
 
+def layered_price(option, initSpot, noShares=100):
+    """
+    Lattice price of a barrier option for the bumped greeks (vega, rho). The plain price only depends on the first
+    node layer past the barrier, so a bump of std (or r) moving the layers across it makes the bump difference noise.
+    Here the prices with the barrier on the node layers S0 x U^k and S0 x U^(k+1) around it are interpolated in
+    ln(barrier), which is continuous in std and r, and averaged over n and n+1 periods (odd / even oscillation).
+    JR has no horizontal layers (drifted nodes), the CRR lattice of the same size is used
+    """
+    if option.model == "BS":
+        return option._engine_price(initSpot, noShares)
+
+    model = "CRR" if option.model == "JR" else option.model
+    prices = []
+    for n in (option.n, option.n + 1):
+        lattice = option._bumped(model=model, n=n)
+        # log step between the layers: ln(u) (CRR), u (TRG, additive)
+        step = lattice.u if model == "TRG" else np.log(lattice.u)
+        x = np.log(lattice.barrier / initSpot) / step
+        k = np.floor(x)
+        layer = lambda j: lattice._bumped(barrier=initSpot * np.exp(j * step))._engine_price(initSpot, noShares)
+        prices.append((1 - (x - k)) * layer(k) + (x - k) * layer(k + 1))
+    return float(sum(prices) / 2)
+
+
 class KnockoutOptions(Vanilla):
-    def __init__(self, name, r, std, tenor, n, strike, opt, barrier, move, fast=False):
-        super().__init__(name, r, std, tenor, n, strike, opt, fast)
+    def __init__(self, name, r, std, tenor, n, strike, opt, barrier, move, fast=False, model="CRR", engine=None,
+                 convergence=None, cache=None):
+        super().__init__(name, r, std, tenor, n, strike, opt, fast, model, engine, convergence, cache)
         self.barrier = barrier
         self.move = move
 
-        # check if terminated
-        self._isTerminated = lambda spot: (self.move == "up" and self.compare_float(spot, self.barrier) >= 0) \
-                                          or (self.move == "down" and self.compare_float(spot, self.barrier) <= 0)
-
-    @logger
-    def price(self, initSpot, noShares=100):
-        if self.fast:
-            return self._fast_price(initSpot, noShares)
+    def _isTerminated(self, spot):
+        # check if terminated (a method, so a _bumped barrier is seen)
+        return (self.move == "up" and self.compare_float(spot, self.barrier) >= 0) \
+            or (self.move == "down" and self.compare_float(spot, self.barrier) <= 0)
+
+    def _engine_price(self, initSpot, noShares=100, top=None):
+        if self.model == "BS":
+            return self._bs_price(initSpot, noShares)
+        elif self.engine == "numba":
+            return self._numba_price(initSpot, noShares, top)
+        elif self.engine == "fast":
+            return self._fast_price(initSpot, noShares, top)
         else:
-            return self._slow_price(initSpot, noShares)
+            return self._slow_price(initSpot, noShares, top)
 
-    def _fast_price(self, initSpot, noShares=100):
-        if self.model != "CRR":
+    def _numba_price(self, initSpot, noShares=100, top=None):
+        self.check_precision()
+        return kernels.knockout_price(*self._numba_args(initSpot, noShares), float(self.barrier), self.move == "up",
+                                      self._top(top), self._numba_leaf(initSpot, noShares, *self._alive()))
+
+    def _fast_price(self, initSpot, noShares=100, top=None):
+        if self.model == "BS":
             raise ValueError("Invalid Model for fast version", self.model)
 
-        # S: size=N+1
-        S = initSpot * self.u ** np.arange(0, self.n + 1, 1) * self.d ** np.arange(self.n, -1, -1)
+        # S: size=start+1
+        start = self._start()
+        S = self.S(initSpot, totalDown=start)
 
-        # initialize PV(1D array): size=N+1
-        if self.opt == "call":
-            PV = np.maximum(S - self.strike, 0) * noShares
-        elif self.opt == "put":
-            PV = np.maximum(self.strike - S, 0) * noShares
-        else:
-            raise ValueError("Invalid option type", self.opt)
+        # initialize PV(1D array): size=start+1
+        PV = self._leaf(S, noShares, None, *self._alive())
 
-        PV[((self.move == "up") & self.is_all_float_ge(S, self.barrier))
-           | ((self.move == "down") & self.is_all_float_le(S, self.barrier))] = 0
+        PV[self._is_all_terminated(S)] = 0
+        self._capture(top, start, PV)
 
-        # n-1...0
-        for i in reversed(range(self.n)):
+        # start-1...0
+        for i in reversed(range(start)):
             # no new copy
             # assign result to the view of PV
             PV[:i + 1] = self.df * (self.pu * PV[1:i + 2] + self.pd * PV[0:i + 1])
             # shrink
             PV = PV[:-1]
             # PV: new size = i
-            S = initSpot * self.u ** np.arange(0, i + 1, 1) * self.d ** np.arange(i, -1, -1)
-            PV[((self.move == "up") & self.is_all_float_ge(S, self.barrier))
-               | ((self.move == "down") & self.is_all_float_le(S, self.barrier))] = 0
+            S = self.S(initSpot, totalDown=i)
+            PV[self._is_all_terminated(S)] = 0
+            self._capture(top, i, PV)
 
         return PV[0]
 
-    def _slow_price(self, initSpot, noShares=100):
+    def _alive(self, barrier=None):
+        # range of S(n) where the contract pays off: (lower, upper)
+        if barrier is None:
+            barrier = self.barrier
+
+        if self.move == "up":
+            return 0.0, barrier
+        return barrier, np.inf
+
+    def _is_all_terminated(self, S, barrier=None):
+        if barrier is None:
+            barrier = self.barrier
+
+        return ((self.move == "up") & self.is_all_float_ge(S, barrier)) \
+               | ((self.move == "down") & self.is_all_float_le(S, barrier))
+
+    def _bs_price(self, initSpot, noShares=100):
+        # continuous barrier (closed form)
+        return float(barrier_analytic.price(initSpot=initSpot, strike=self.strike, barrier=self.barrier, r=self.r,
+                                            std=self.std, tenor=self.tenor, opt=self.opt, move=self.move,
+                                            inout="out", noShares=noShares))
+
+    def _bs_greeks(self, initSpot, noShares=100):
+        return self._bump_greeks(initSpot, noShares)
+
+    def _bump_price(self, initSpot, noShares=100):
+        return layered_price(self, initSpot, noShares)
+
+    def price_strikes(self, initSpot, strikes, barriers=None, noShares=100):
+        strikes = np.asarray(strikes, dtype=np.float64)
+        # one barrier per strike (default: the contract barrier for all of them)
+        barriers = np.broadcast_to(self.barrier if barriers is None else np.asarray(barriers, dtype=np.float64),
+                                   strikes.shape)
+        if self.model == "BS":
+            return barrier_analytic.price(initSpot=initSpot, strike=strikes, barrier=barriers, r=self.r,
+                                          std=self.std, tenor=self.tenor, opt=self.opt, move=self.move,
+                                          inout="out", noShares=noShares)
+
+        return self._extrapolate(lambda lattice: lattice._ladder(initSpot, strikes, barriers[:, np.newaxis], noShares))
+
+    def _ladder(self, initSpot, strikes, barriers, noShares=100):
+        # PV(2D array): size=K x (start+1)
+        start = self._start()
+        S = self.S(initSpot, totalDown=start)
+        PV = self._leaf(S[np.newaxis, :], noShares, strikes[:, np.newaxis], *self._alive(barriers))
+        PV[self._is_all_terminated(S[np.newaxis, :], barriers)] = 0
+
+        # start-1...0
+        for i in reversed(range(start)):
+            PV[:, :i + 1] = self.df * (self.pu * PV[:, 1:i + 2] + self.pd * PV[:, 0:i + 1])
+            PV = PV[:, :-1]
+            S = self.S(initSpot, totalDown=i)
+            PV[self._is_all_terminated(S[np.newaxis, :], barriers)] = 0
+
+        return PV[:, 0]
+
+    def _slow_price(self, initSpot, noShares=100, top=None):
         pv = np.zeros(self.n + 1, dtype=np.longdouble)
 
         # base case - check if it's already been terminated
         if self._isTerminated(initSpot):
             return 0  # terminated contract
 
-        # base case - PV(n-1)
-        for j in range(self.n + 1):
-            spot = self.s(initSpot, totalDown=self.n, noUp=j)
+        # base case - PV(n-1), or BS PV over the last period at PV(n-1)
+        start = self._start()
+        if start < self.n:
+            leaf = self._leaf(self.S(initSpot, totalDown=start), noShares, None, *self._alive())
+        for j in range(start + 1):
+            spot = self.s(initSpot, totalDown=start, noUp=j)
             if not self._isTerminated(spot):
-                if self.opt == "call":
+                if start < self.n:
+                    pv[j] = leaf[j]
+                elif self.opt == "call":
                     pv[j] = max(0.0, spot - self.strike) * noShares
                 else:
                     pv[j] = max(0.0, self.strike - spot) * noShares
             else:
                 pv[j] = 0.0
+        self._capture(top, start, pv)
 
-        for i in reversed(range(self.n)):
+        for i in reversed(range(start)):
             for j in range(i + 1):
                 spot = self.s(initSpot, totalDown=i, noUp=j)
                 if self._isTerminated(spot):
                     pv[j] = 0.0
                 else:
                     pv[j] = self._f(pvUp=pv[j + 1], pvDown=pv[j])
+            self._capture(top, i, pv)
 
         return pv[0]
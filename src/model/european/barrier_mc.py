@@ -0,0 +1,151 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from src.model.european import logger
+from src.model.european.barrier_analytic import is_up, is_out
+from src.model.european.black_scholes import is_call
+from src.model.european.derivatives import Derivatives
+from src.qmc import GENERATORS, normal_blocks, replication_seeds
+
+"""
+Monte Carlo price of single barrier options, an independent check on KnockoutOptions / KnockInOptions and a base
+for barrier features the lattice can't handle easily.
+
+GBM over the n steps of h = tenor / n (same parameters as the lattice):
+    S(i+1) = S(i) * e^((r - std^2/2)h + std*sqrt(h)*Z)
+
+Brownian bridge correction (bridge=True): between two grid points that are both on the alive side of the barrier H,
+the path still crosses H with probability
+    p(i) = e^(-2 * ln(H/S(i)) * ln(H/S(i+1)) / (std^2 * h))
+so a path survives with probability prod(1 - p(i)) and knock-out PV = e^(-rT) * E[payoff * survival] is unbiased for
+the continuously monitored barrier even on a coarse grid (knock-in: payoff * (1 - survival)). With bridge=False the
+barrier is only monitored at the n grid points (discrete monitoring).
+
+The paths are simulated chunk paths at a time (memory ~ chunk x n float64), chunk k from its own
+np.random.SeedSequence(seed).spawn(...) stream, so the price only depends on (seed, paths, chunk), not on workers
+(chunks run on a thread pool, numpy releases the GIL in the heavy array operations).
+
+generator="sobol" draws the n normals of a path from scrambled Sobol points with Brownian bridge ordering (see qmc),
+split into replications independent randomizations of paths / replications points (a power of 2), simulated chunk
+points at a time, one replication per task on the thread pool: the stderr is the one of the mean over the
+replications.
+"""
+
+
+class BarrierMC(Derivatives):
+    style = "European"
+
+    def __init__(self, name, r, std, tenor, n, strike, opt, barrier, move, inout="out", paths=100000, chunk=10000,
+                 seed=1, workers=1, bridge=True, generator="pseudo", replications=16):
+        super().__init__(name=name, tenor=tenor, n=n)
+        is_call(opt)
+        is_up(move)
+        is_out(inout)
+        if paths <= 0 or chunk <= 0 or workers <= 0:
+            raise ValueError("paths, chunk and workers should be positive", paths, chunk, workers)
+        if generator not in GENERATORS:
+            raise ValueError("Invalid generator(pseudo or sobol)", generator)
+        if generator == "sobol" and (replications < 2 or paths % replications != 0):
+            raise ValueError("paths should split into 2 or more replications", paths, replications)
+
+        self.r = r
+        self.std = std
+        self.strike = strike
+        self.opt = opt
+        self.barrier = barrier
+        self.move = move
+        self.inout = inout
+        self.paths = paths
+        self.chunk = chunk
+        self.seed = seed
+        self.workers = workers
+        self.bridge = bridge
+        self.generator = generator
+        self.replications = replications
+
+    def __str__(self):
+        return self.name + ", MC paths = " + str(self.paths) + " , chunk = " + str(self.chunk) + \
+               " , bridge = " + str(self.bridge) + " , generator = " + self.generator + " , N = " + str(self.n)
+
+    @logger
+    def price(self, initSpot, noShares=100):
+        return self.price_stats(initSpot, noShares)["price"]
+
+    def price_stats(self, initSpot, noShares=100):
+        # return: {"price", "stderr", "paths"}
+        if self.generator == "sobol":
+            return self._sobol_stats(initSpot, noShares)
+
+        sizes = [min(self.chunk, self.paths - start) for start in range(0, self.paths, self.chunk)]
+        seeds = np.random.SeedSequence(self.seed).spawn(len(sizes))
+        chunks = self._map(lambda args: self._chunk(initSpot, *args), list(zip(sizes, seeds)))
+
+        # Chan et al. combination of the chunks, in chunk order
+        total, mean, m2 = 0, 0.0, 0.0
+        for size, (chunk_mean, chunk_m2) in zip(sizes, chunks):
+            delta = chunk_mean - mean
+            mean += delta * size / (total + size)
+            m2 += chunk_m2 + delta ** 2 * total * size / (total + size)
+            total += size
+
+        stderr = np.sqrt(m2 / (total - 1) / total) if total > 1 else 0.0
+        return {"price": float(mean * noShares), "stderr": float(stderr * noShares), "paths": total}
+
+    def _sobol_stats(self, initSpot, noShares):
+        size = self.paths // self.replications
+        means = self._map(lambda seed: self._replication(initSpot, size, seed),
+                          replication_seeds(self.seed, self.replications))
+
+        stderr = np.std(means, ddof=1) / np.sqrt(self.replications)
+        return {"price": float(np.mean(means) * noShares), "stderr": float(stderr * noShares), "paths": self.paths}
+
+    def _map(self, f, items):
+        # f of every item, on the thread pool with workers > 1, in the order of items
+        if self.workers == 1:
+            return [f(item) for item in items]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(f, items))
+
+    def _chunk(self, initSpot, size, seed):
+        # (mean, M2) of the discounted PV of size paths for 1 share
+        pv = np.exp(-self.r * self.tenor) * self._payoffs(initSpot,
+                                                          np.random.default_rng(seed).standard_normal((size, self.n)))
+        mean = pv.mean()
+        return mean, np.sum((pv - mean) ** 2)
+
+    def _replication(self, initSpot, size, seed):
+        # mean discounted PV of the size Sobol points of one randomization for 1 share
+        total = sum(self._payoffs(initSpot, z).sum() for z in normal_blocks(size, self.n, self.chunk, "sobol", seed))
+        return np.exp(-self.r * self.tenor) * total / size
+
+    def _payoffs(self, initSpot, z):
+        # payoffs of the paths of the (paths x n) normals z
+        size = len(z)
+        up = self.move == "up"
+        drift = (self.r - self.std ** 2 / 2) * self.h
+        log_returns = drift + self.std * np.sqrt(self.h) * z
+        log_spot = np.log(initSpot) + np.cumsum(log_returns, axis=1)
+
+        # log(H/S(i)), i = 0...n, > 0 on the alive side of an up barrier
+        distance = np.log(self.barrier) - np.hstack([np.full((size, 1), np.log(initSpot)), log_spot])
+        if not up:
+            distance = -distance
+
+        # knocked at a grid point (including t=0)
+        survival = np.where(np.any(distance <= 0, axis=1), 0.0, 1.0)
+        if self.bridge:
+            # crossed between the grid points
+            alive = survival > 0
+            p = np.exp(-2 * distance[alive, :-1] * distance[alive, 1:] / (self.std ** 2 * self.h))
+            survival[alive] = np.prod(1 - p, axis=1)
+
+        terminal = np.exp(log_spot[:, -1])
+        if self.opt == "call":
+            payoff = np.maximum(terminal - self.strike, 0)
+        else:
+            payoff = np.maximum(self.strike - terminal, 0)
+
+        if self.inout == "out":
+            return payoff * survival
+        return payoff * (1 - survival)
@@ -0,0 +1,72 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+"""
+Opt-in, size-bounded LRU cache of valuations, shared by any number of Vanilla / KnockoutOptions / KnockInOptions
+instances (pass cache=PricingCache(...) to the constructor).
+
+The key is the full pricing key of the call, so a hit is only possible when every input is the same. With
+spot_quantum the spot is rounded to that grid before pricing, so nearly identical requests share an entry
+(the cached PV is the PV at the rounded spot).
+"""
+
+PricingKey = namedtuple('PricingKey', ['kind', 'func', 'model', 'r', 'std', 'tenor', 'n', 'strike', 'opt',
+                                       'barrier', 'move', 'spot', 'shares', 'engine', 'convergence', 'extra'])
+
+
+class PricingCache:
+    def __init__(self, maxsize=1024, spot_quantum=None):
+        if maxsize <= 0:
+            raise ValueError("maxsize should be positive", maxsize)
+
+        self.maxsize = maxsize
+        self.spot_quantum = spot_quantum
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def quantize(self, spot):
+        if self.spot_quantum is None:
+            return spot
+        return round(spot / self.spot_quantum) * self.spot_quantum
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                # least recently used
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, **fields):
+        # drop every entry whose key matches all the given fields (e.g. spot=100.0, strike=95.0), or all entries
+        with self._lock:
+            if not fields:
+                removed = len(self._entries)
+                self._entries.clear()
+                return removed
+
+            keys = [key for key in self._entries if all(getattr(key, k) == v for k, v in fields.items())]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def stats(self):
+        return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions}
@@ -17,10 +17,13 @@ class Derivatives(ABC):
         if self.n is not None:
             self.h = self.tenor / self.n
 
-    def compare_float(self, a, b, epsilon=1e-9):
+    def check_precision(self, epsilon=1e-9):
         if self.h ** 2 < epsilon:
             raise PrecisionError("epsilon is not smaller enough than input parameter for pricing", self.h ** 2)
 
+    def compare_float(self, a, b, epsilon=1e-9):
+        self.check_precision(epsilon)
+
         if math.isclose(a, b, abs_tol=epsilon):
             return 0
         elif a > b:
@@ -29,16 +32,14 @@ class Derivatives(ABC):
             return -1
 
     def is_all_float_ge(self, a, b, epsilon=1e-9):
-        if self.h ** 2 < epsilon:
-            raise PrecisionError("epsilon is not smaller enough than input parameter for pricing", self.h ** 2)
+        self.check_precision(epsilon)
 
-        return np.allclose(a, b, atol=epsilon) | (a > b)
+        return np.isclose(a, b, rtol=1e-09, atol=epsilon) | (a > b)
 
     def is_all_float_le(self, a, b, epsilon=1e-9):
-        if self.h ** 2 < epsilon:
-            raise PrecisionError("epsilon is not smaller enough than input parameter for pricing", self.h ** 2)
+        self.check_precision(epsilon)
 
-        return np.allclose(a, b, atol=epsilon) | (a < b)
+        return np.isclose(a, b, rtol=1e-09, atol=epsilon) | (a < b)
 
     @abstractmethod
     def price(self, initSpot, noShares):
@@ -0,0 +1,115 @@
+import numpy as np
+
+from src.model.european import black_scholes
+
+"""
+Batch implied volatility: backs out std from arrays of option prices in one call.
+
+Every element runs its own safeguarded Newton iteration, vectorized across the batch:
+    1. the bracket [lower, upper] is kept per element (PV is increasing in std, so PV(std) > price moves
+       the upper end down and vice versa)
+    2. Newton step std - (PV(std) - price) / vega, using the BS vega (black_scholes.vega)
+    3. bisection of the bracket whenever the Newton step leaves it or vega is too small
+
+An element is converged once the Newton correction |PV(std) - price| / vega or the bracket is within tol (in
+std), so deep out-of-the-money contracts with tiny prices are still solved to the same precision. Prices outside
+[PV(lower), PV(upper)] (e.g. below intrinsic value) have no solution and are returned as nan, not converged.
+
+implied_vol() inverts the closed form; implied_vol_lattice() inverts any tree engine of a Vanilla /
+KnockoutOptions / KnockInOptions (same model, engine, n and convergence mode), one valuation per element and
+iteration. The BS vega is only the slope of the Newton step there, the bracket keeps it convergent.
+Barrier PVs are not monotone in std: pass a [lower, upper] on which the PV is increasing.
+"""
+
+
+def implied_vol(price, initSpot, strike, r, tenor, opt, noShares=100, guess=0.2, lower=1e-4, upper=5.0,
+                tol=1e-10, max_iter=100):
+    """
+    price: PV of noShares shares (same unit as Vanilla.price), all arguments broadcast
+    return: (std, converged) arrays of the broadcast shape
+    """
+    price, initSpot, strike, r, tenor, opt = np.broadcast_arrays(
+        np.asarray(price, dtype=np.float64), *[np.asarray(x, dtype=np.float64) for x in (initSpot, strike, r, tenor)],
+        np.asarray(opt))
+    shape = price.shape
+    price, initSpot, strike, r, tenor, opt = [x.ravel() for x in (price, initSpot, strike, r, tenor, opt)]
+
+    def pv(std, active):
+        return black_scholes.price(initSpot[active], strike[active], r[active], std, tenor[active], opt[active],
+                                   noShares)
+
+    def vega(std, active):
+        return black_scholes.vega(initSpot[active], strike[active], r[active], std, tenor[active], noShares)
+
+    return _solve(shape, price, pv, vega, guess, lower, upper, tol, max_iter)
+
+
+def implied_vol_lattice(price, initSpot, option, strike=None, noShares=100, guess=0.2, lower=None, upper=5.0,
+                        tol=1e-10, max_iter=100):
+    """
+    option: the contract and lattice to invert (its std is ignored); strike: per element strikes, default option.strike
+    lower: default keeps 0 < pu < 1 (CRR needs std > |r| * sqrt(h)), also on the n/2 lattice of richardson/bbsr
+    return: (std, converged) arrays of the broadcast shape
+    """
+    if lower is None:
+        lower = 1e-4 if option.n is None else max(1e-4, 2.0 * abs(option.r) * np.sqrt(2.0 * option.h))
+    strike = option.strike if strike is None else strike
+    price, initSpot, strike = np.broadcast_arrays(*[np.asarray(x, dtype=np.float64)
+                                                    for x in (price, initSpot, strike)])
+    shape = price.shape
+    price, initSpot, strike = [x.ravel() for x in (price, initSpot, strike)]
+
+    def pv(std, active):
+        return np.array([option._bumped(std=s, strike=k)._extrapolate(
+            lambda lattice: lattice._engine_price(spot, noShares))
+            for s, spot, k in zip(std, initSpot[active], strike[active])], dtype=np.float64)
+
+    def vega(std, active):
+        return black_scholes.vega(initSpot[active], strike[active], option.r, std, option.tenor, noShares)
+
+    return _solve(shape, price, pv, vega, guess, lower, upper, tol, max_iter)
+
+
+def _solve(shape, price, pv, vega, guess, lower, upper, tol, max_iter):
+    # pv(std, active) / vega(std, active): values of the elements in the boolean mask active at std (1D)
+    std = np.full(price.size, guess, dtype=np.float64)
+    lo = np.full(price.size, lower, dtype=np.float64)
+    hi = np.full(price.size, upper, dtype=np.float64)
+    converged = np.zeros(price.size, dtype=bool)
+
+    if price.size == 0:
+        return std.reshape(shape), converged.reshape(shape)
+
+    # no solution within the bracket
+    everything = np.ones(price.size, dtype=bool)
+    feasible = (pv(lo, everything) <= price) & (price <= pv(hi, everything)) & np.isfinite(price)
+    std[~feasible] = np.nan
+    std[feasible] = np.clip(std[feasible], lower, upper)
+
+    active = feasible.copy()
+    for _ in range(max_iter):
+        if not np.any(active):
+            break
+
+        s = std[active]
+        diff = pv(s, active) - price[active]
+
+        # shrink the bracket around the root
+        lo_a = np.where(diff < 0, s, lo[active])
+        hi_a = np.where(diff > 0, s, hi[active])
+
+        # Newton, or bisection when the step leaves the bracket
+        v = vega(s, active)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = s - diff / v
+        done = (diff == 0) | (np.abs(s - step) <= tol) | ((hi_a - lo_a) <= tol)
+        bisect = ~np.isfinite(step) | (step <= lo_a) | (step >= hi_a)
+        step = np.where(bisect, (lo_a + hi_a) / 2.0, step)
+
+        converged[np.flatnonzero(active)[done]] = True
+        lo[active] = lo_a
+        hi[active] = hi_a
+        std[active] = np.where(done, s, step)
+        active[active] = ~done
+
+    return std.reshape(shape), converged.reshape(shape)
@@ -0,0 +1,140 @@
+import numpy as np
+from numba import njit
+
+"""
+http://numba.pydata.org/
+
+Compiled equivalents of the pure-Python tree engines (Vanilla._vanilla, KnockoutOptions._slow_price and
+KnockInOptions._slow_price). They walk the same nodes in the same order and do the same per-node barrier
+check as compare_float, without the lambda calls.
+
+up, down: the lattice tables of the instance, s(i,j) = s0 * up[j] * down[i-j] (u^j * d^(i-j), or
+e^(u*j) * e^(d*(i-j)) for the trigeorgis(TRG) lattice)
+
+leaf: empty, or the BS smoothed PV at period n-1 (convergence="bbs") to start the backward induction from
+"""
+
+
+@njit(cache=True)
+def _spot(initSpot, up, down, totalDown, noUp):
+    return initSpot * up[noUp] * down[totalDown - noUp]
+
+
+@njit(cache=True)
+def _compare_float(a, b, epsilon):
+    # same as math.isclose(a, b, abs_tol=epsilon) in Derivatives.compare_float
+    if abs(a - b) <= max(1e-09 * max(abs(a), abs(b)), epsilon):
+        return 0
+    elif a > b:
+        return 1
+    else:
+        return -1
+
+
+@njit(cache=True)
+def _is_crossed(spot, barrier, is_up, epsilon):
+    # knock-out: terminated, knock-in: activated
+    if is_up:
+        return _compare_float(spot, barrier, epsilon) >= 0
+    return _compare_float(spot, barrier, epsilon) <= 0
+
+
+@njit(cache=True)
+def _payoff(spot, strike, is_call, noShares):
+    if is_call:
+        return max(0.0, spot - strike) * noShares
+    return max(0.0, strike - spot) * noShares
+
+
+@njit(cache=True)
+def _capture(top, i, pv):
+    # PV at period i <= 2 for the lattice greeks
+    if i <= 2:
+        for j in range(i + 1):
+            top[i, j] = pv[j]
+
+
+@njit(cache=True)
+def vanilla_price(initSpot, strike, is_call, noShares, n, up, down, pu, pd, df, top, leaf):
+    pv = np.zeros(n + 1)
+
+    start = n
+    if leaf.size > 0:
+        start = leaf.size - 1
+        pv[:start + 1] = leaf
+    else:
+        # base case - PV(n-1)
+        for j in range(n + 1):
+            pv[j] = _payoff(_spot(initSpot, up, down, n, j), strike, is_call, noShares)
+    _capture(top, start, pv)
+
+    for i in range(start - 1, -1, -1):
+        for j in range(i + 1):
+            pv[j] = df * (pu * pv[j + 1] + pd * pv[j])
+        _capture(top, i, pv)
+
+    return pv[0]
+
+
+@njit(cache=True)
+def knockout_price(initSpot, strike, is_call, noShares, n, up, down, pu, pd, df, barrier, is_up, top, leaf,
+                   epsilon=1e-9):
+    # base case - check if it's already been terminated
+    if _is_crossed(initSpot, barrier, is_up, epsilon):
+        return 0.0
+
+    pv = np.zeros(n + 1)
+
+    # base case - PV(n-1)
+    start = n if leaf.size == 0 else leaf.size - 1
+    for j in range(start + 1):
+        spot = _spot(initSpot, up, down, start, j)
+        if not _is_crossed(spot, barrier, is_up, epsilon):
+            if leaf.size > 0:
+                pv[j] = leaf[j]
+            else:
+                pv[j] = _payoff(spot, strike, is_call, noShares)
+    _capture(top, start, pv)
+
+    for i in range(start - 1, -1, -1):
+        for j in range(i + 1):
+            if _is_crossed(_spot(initSpot, up, down, i, j), barrier, is_up, epsilon):
+                pv[j] = 0.0
+            else:
+                pv[j] = df * (pu * pv[j + 1] + pd * pv[j])
+        _capture(top, i, pv)
+
+    return pv[0]
+
+
+@njit(cache=True)
+def knockin_price(initSpot, strike, is_call, noShares, n, up, down, pu, pd, df, barrier, is_up, top, vleaf,
+                  leaf, epsilon=1e-9):
+    # vanilla PV and knock-in PV side by side
+    vpv = np.zeros(n + 1)
+    pv = np.zeros(n + 1)
+
+    # base case - PV(n-1), leaf: knock-in PV of the nodes not activated yet
+    start = n if leaf.size == 0 else leaf.size - 1
+    for j in range(start + 1):
+        spot = _spot(initSpot, up, down, start, j)
+        if leaf.size > 0:
+            vpv[j] = vleaf[j]
+            pv[j] = leaf[j]
+        else:
+            vpv[j] = _payoff(spot, strike, is_call, noShares)
+        if _is_crossed(spot, barrier, is_up, epsilon):
+            pv[j] = vpv[j]
+    _capture(top, start, pv)
+
+    for i in range(start - 1, -1, -1):
+        for j in range(i + 1):
+            vpv[j] = df * (pu * vpv[j + 1] + pd * vpv[j])
+            # becomes vanilla options at activated (i,j)
+            if _is_crossed(_spot(initSpot, up, down, i, j), barrier, is_up, epsilon):
+                pv[j] = vpv[j]
+            else:
+                pv[j] = df * (pu * pv[j + 1] + pd * pv[j])
+        _capture(top, i, pv)
+
+    return pv[0]
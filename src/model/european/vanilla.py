@@ -1,6 +1,9 @@
+import copy
+
 import numpy as np
 
-from src.model.european import logger
+from src.model.european import logger, cached, black_scholes, kernels
+from src.model.european.cache import PricingKey
 from src.model.european.derivatives import *
 from scipy.stats import norm
 
@@ -8,21 +11,37 @@ from scipy.stats import norm
 class Vanilla(Derivatives):
     style = "European"
 
-    def __init__(self, name, r, std, tenor, n, strike, opt, fast=False, model="CRR"):
+    def __init__(self, name, r, std, tenor, n, strike, opt, fast=False, model="CRR", engine=None, convergence=None,
+                 cache=None):
         super().__init__(name=name, tenor=tenor, n=n)
         self.r = r
         self.std = std
         self.strike = strike
         self.opt = opt
-        self.fast = fast
+        # engine: slow(pure python), fast(numpy vectorization) or numba(compiled slow version)
+        if engine is None:
+            engine = "fast" if fast else "slow"
+        if engine not in ("slow", "fast", "numba"):
+            raise ValueError("Invalid engine(slow, fast or numba)", engine)
+        self.engine = engine
+        self.fast = engine == "fast"
+        # convergence: bbs(BS smoothed last period), richardson(PV(n) and PV(n//2), see _extrapolate) or bbsr(both)
+        if convergence not in (None, "bbs", "richardson", "bbsr"):
+            raise ValueError("Invalid convergence(bbs, richardson or bbsr)", convergence)
+        self.convergence = convergence
+        # cache: PricingCache shared across instances (opt-in)
+        self.cache = cache
         self.model = model
-        if model == "CRR":
+        self._setup_model()
+
+    def _setup_model(self):
+        if self.model == "CRR":
             self._crr()
-        elif model == "JR":
+        elif self.model == "JR":
             self._jr()
-        elif model == "TRG":
+        elif self.model == "TRG":
             self._trg()
-        elif model == "BS":
+        elif self.model == "BS":
             self._bs()
         else:
             raise ValueError("Invalid Model(CRR or TRG)")
@@ -39,9 +58,17 @@ class Vanilla(Derivatives):
         self._f = lambda pvUp, pvDown: \
             self.df * (self.pu * pvUp + self.pd * pvDown)
 
+        # u^j and d^j, j = 0...n: built once, shared by every engine and price() call
+        self._up = self.u ** np.arange(0, self.n + 1, 1)
+        self._down = self.d ** np.arange(0, self.n + 1, 1)
+
         # s(i,j) = s0 * u^j * d^i-j
         self.s = lambda initSpot, totalDown, noUp: \
-            initSpot * self.u ** noUp * self.d ** (totalDown - noUp)
+            initSpot * self._up[noUp] * self._down[totalDown - noUp]
+
+        # S(i) = s0 * u^[0...i] * d^[i...0], i.e. s(i,j) of all nodes j at period i
+        self.S = lambda initSpot, totalDown: \
+            initSpot * self._up[:totalDown + 1] * self._down[totalDown::-1]
 
     def _jr(self):
         # self.h = self.tenor / self.n
@@ -56,9 +83,17 @@ class Vanilla(Derivatives):
         self._f = lambda pvUp, pvDown: \
             self.df * (self.pu * pvUp + self.pd * pvDown)
 
+        # u^j and d^j, j = 0...n: built once, shared by every engine and price() call
+        self._up = self.u ** np.arange(0, self.n + 1, 1)
+        self._down = self.d ** np.arange(0, self.n + 1, 1)
+
         # s(i,j) = s0 * u^j * d^i-j
         self.s = lambda initSpot, totalDown, noUp: \
-            initSpot * self.u ** noUp * self.d ** (totalDown - noUp)
+            initSpot * self._up[noUp] * self._down[totalDown - noUp]
+
+        # S(i) = s0 * u^[0...i] * d^[i...0], i.e. s(i,j) of all nodes j at period i
+        self.S = lambda initSpot, totalDown: \
+            initSpot * self._up[:totalDown + 1] * self._down[totalDown::-1]
 
     def _trg(self):
         # self.h = self.tenor / self.n
@@ -74,9 +109,17 @@ class Vanilla(Derivatives):
         self._f = lambda pvUp, pvDown: \
             self.df * (self.pu * pvUp + self.pd * pvDown)
 
-        # s(i,j) = s0 * u^j * d^i-j
+        # e^(u*j) and e^(d*j), j = 0...n: built once, shared by every engine and price() call
+        self._up = np.exp(self.u * np.arange(0, self.n + 1, 1))
+        self._down = np.exp(self.d * np.arange(0, self.n + 1, 1))
+
+        # s(i,j) = s0 * e^(u*j) * e^(d*(i-j))
         self.s = lambda initSpot, totalDown, noUp: \
-            initSpot * np.exp(self.u * noUp) * np.exp(self.d * (totalDown - noUp))
+            initSpot * self._up[noUp] * self._down[totalDown - noUp]
+
+        # S(i) = s0 * e^(u*[0...i]) * e^(d*[i...0]), i.e. s(i,j) of all nodes j at period i
+        self.S = lambda initSpot, totalDown: \
+            initSpot * self._up[:totalDown + 1] * self._down[totalDown::-1]
 
     def _bs(self):
         # common
@@ -98,22 +141,70 @@ class Vanilla(Derivatives):
         self._rho = lambda N2, t, pv_k: self.ttm(t) * pv_k * N2
 
         # PV
-        self._bs = lambda delta, St, N2, pv_k: delta * St - N2 * pv_k
+        self._bs_pv = lambda delta, St, N2, pv_k: delta * St - N2 * pv_k
 
     def __str__(self):
-        return self.name + ", fast_version = " + str(self.fast) + " , model = " + self.model + " , N = " + str(self.n)
+        return self.name + ", fast_version = " + str(self.fast) + " , engine = " + self.engine + " , model = " \
+               + self.model + " , N = " + str(self.n)
+
+    def _start(self):
+        # period the backward induction starts from: n, or n-1 with the BS smoothed PV (bbs)
+        if self.convergence in ("bbs", "bbsr"):
+            return self.n - 1
+        return self.n
+
+    def _leaf(self, S, noShares=100, strike=None, lower=0.0, upper=np.inf):
+        """
+        PV(start, j) for the spots S at period self._start()
+          * payoff at period n
+          * bbs: BS PV over the last period of the payoff paid only if lower <= S(n) < upper
+        """
+        if strike is None:
+            strike = self.strike
+        if self.opt != "call" and self.opt != "put":
+            raise ValueError("Invalid option type", self.opt)
+
+        if self._start() < self.n:
+            return black_scholes.range_price(S, strike, lower, upper, self.r, self.std, self.h, self.opt) * noShares
+        elif self.opt == "call":
+            return np.maximum(S - strike, 0) * noShares
+        else:
+            return np.maximum(strike - S, 0) * noShares
+
+    def _extrapolate(self, f):
+        """
+        richardson: (n x PV(n) - m x PV(m)) / (n - m) with m = n // 2 cancels the O(1/n) error term
+        (2 x PV(n) - PV(n/2) for an even n), f: lattice -> PV (or dict of greeks)
+        """
+        if self.model == "BS" or self.convergence not in ("richardson", "bbsr"):
+            return f(self)
+        if self.n < 2:
+            raise ValueError("Richardson extrapolation needs n >= 2", self.n)
+
+        m = self.n // 2
+        fine_weight, coarse_weight = self.n / (self.n - m), m / (self.n - m)
+        fine = f(self)
+        coarse = f(self._bumped(n=m))
+        if isinstance(fine, dict):
+            return {k: fine_weight * fine[k] - coarse_weight * coarse[k] for k in fine}
+        return fine_weight * fine - coarse_weight * coarse
 
     def _vanilla(self, initSpot, noShares=100):
         # pv(i,j)
         pv = np.zeros((self.n + 1, self.n + 1), dtype=np.longdouble)
 
-        # base case - PV(n-1)
-        for j in range(self.n + 1):
-            spot = self.s(initSpot, totalDown=self.n, noUp=j)
-            if self.opt == "call":
-                pv[self.n][j] = max(0, spot - self.strike) * noShares
-            else:
-                pv[self.n][j] = max(0, self.strike - spot) * noShares
+        start = self._start()
+        if start < self.n:
+            # base case - BS PV over the last period at PV(n-1)
+            pv[start][:start + 1] = self._leaf(self.S(initSpot, totalDown=start), noShares)
+        else:
+            # base case - PV(n-1)
+            for j in range(self.n + 1):
+                spot = self.s(initSpot, totalDown=self.n, noUp=j)
+                if self.opt == "call":
+                    pv[self.n][j] = max(0, spot - self.strike) * noShares
+                else:
+                    pv[self.n][j] = max(0, self.strike - spot) * noShares
 
         """
         version 1
@@ -129,49 +220,116 @@ class Vanilla(Derivatives):
                for j in range(i + 1):             //0…N-1, 0…..N-2, 0…..N-3,....., 0
         """
         # Vanilla price
-        for i in reversed(range(self.n)):
+        for i in reversed(range(start)):
             for j in range(i + 1):
                 pv[i][j] = self._f(pvUp=pv[i + 1][j + 1], pvDown=pv[i + 1][j])
 
         return pv
 
+    def _cache_key(self, func, initSpot, noShares, extra=()):
+        return PricingKey(kind=type(self).__name__, func=func, model=self.model, r=self.r, std=self.std,
+                          tenor=self.tenor, n=self.n, strike=self.strike, opt=self.opt,
+                          barrier=getattr(self, "barrier", None), move=getattr(self, "move", None), spot=initSpot,
+                          shares=noShares, engine=self.engine, convergence=self.convergence, extra=extra)
+
     @logger
+    @cached
     def price(self, initSpot, noShares=100):
+        return self._extrapolate(lambda lattice: lattice._engine_price(initSpot, noShares))
+
+    def _engine_price(self, initSpot, noShares=100, top=None):
         if self.model == "BS":
             return self._bs_price(initSpot, noShares)
         else:
-            if self.fast:
-                return self._fast_price(initSpot, noShares)
+            if self.engine == "numba":
+                return self._numba_price(initSpot, noShares, top)
+            elif self.engine == "fast":
+                return self._fast_price(initSpot, noShares, top)
             else:
                 pv = self._vanilla(initSpot, noShares)
+                if top is not None:
+                    top[:, :] = pv[:3, :3]
                 return pv[0][0]
 
-    def _fast_price(self, initSpot, noShares=100):
-        if self.model != "CRR":
-            raise ValueError("Invalid Model for fast version", self.model)
+    def _capture(self, top, i, PV):
+        # PV at period i <= 2 for the lattice greeks
+        if top is not None and i <= 2:
+            top[i, :i + 1] = PV[:i + 1]
 
-        # S: size=N+1
-        S = initSpot * self.u ** np.arange(0, self.n + 1, 1) * self.d ** np.arange(self.n, -1, -1)
+    def _top(self, top):
+        # the compiled engines always fill a buffer
+        return np.zeros((3, 3)) if top is None else top
 
-        # initialize PV(1D array): size=N+1
-        if self.opt == "call":
-            PV = np.maximum(S - self.strike, 0) * noShares
-        elif self.opt == "put":
-            PV = np.maximum(self.strike - S, 0) * noShares
-        else:
+    def _numba_args(self, initSpot, noShares):
+        if self.model == "BS":
+            raise ValueError("Invalid Model for numba version", self.model)
+        if self.opt != "call" and self.opt != "put":
             raise ValueError("Invalid option type", self.opt)
 
-        # n-1...0
-        for i in reversed(range(self.n)):
+        return (float(initSpot), float(self.strike), self.opt == "call", float(noShares), self.n,
+                self._up, self._down, float(self.pu), float(self.pd), float(self.df))
+
+    def _numba_leaf(self, initSpot, noShares=100, lower=0.0, upper=np.inf):
+        # the compiled engines start from the payoff at period n unless given the bbs PV at period n-1
+        if self._start() == self.n:
+            return np.empty(0)
+        return np.asarray(self._leaf(self.S(initSpot, totalDown=self._start()), noShares, lower=lower, upper=upper),
+                          dtype=np.float64)
+
+    def _numba_price(self, initSpot, noShares=100, top=None):
+        return kernels.vanilla_price(*self._numba_args(initSpot, noShares), self._top(top),
+                                     self._numba_leaf(initSpot, noShares))
+
+    def _fast_price(self, initSpot, noShares=100, top=None):
+        if self.model == "BS":
+            raise ValueError("Invalid Model for fast version", self.model)
+
+        # S: size=start+1
+        start = self._start()
+        S = self.S(initSpot, totalDown=start)
+
+        # initialize PV(1D array): size=start+1
+        PV = self._leaf(S, noShares)
+        self._capture(top, start, PV)
+
+        # start-1...0
+        for i in reversed(range(start)):
             # no new copy
             # assign result to the view of PV
             PV[:i + 1] = self.df * (self.pu * PV[1:i + 2] + self.pd * PV[0:i + 1])
             # shrink
             PV = PV[:-1]
             # PV: new size = i
+            self._capture(top, i, PV)
 
         return PV[0]
 
+    """
+    Strike ladder: one (strikes x nodes) 2D numpy Array inducted once on the shared spot lattice
+      * Time complexity: N^2 (vectorized over strikes)
+      * Space complexity: K x N
+    """
+
+    def price_strikes(self, initSpot, strikes, noShares=100):
+        strikes = np.asarray(strikes, dtype=np.float64)
+        if self.model == "BS":
+            return black_scholes.price(initSpot=initSpot, strike=strikes, r=self.r, std=self.std, tenor=self.tenor,
+                                       opt=self.opt, noShares=noShares)
+
+        return self._extrapolate(lambda lattice: lattice._ladder(initSpot, strikes, noShares))
+
+    def _ladder(self, initSpot, strikes, noShares=100):
+        # PV(2D array): size=K x (start+1)
+        start = self._start()
+        PV = self._leaf(self.S(initSpot, totalDown=start)[np.newaxis, :], noShares, strikes[:, np.newaxis])
+
+        # start-1...0
+        for i in reversed(range(start)):
+            PV[:, :i + 1] = self.df * (self.pu * PV[:, 1:i + 2] + self.pd * PV[:, 0:i + 1])
+            PV = PV[:, :-1]
+
+        return PV[:, 0]
+
     def _bs_price(self, initSpot, noShares=100):
         d1 = self.d1(initSpot, 0)
         d2 = self.d2(d1, 0)
@@ -185,7 +343,83 @@ class Vanilla(Derivatives):
         else:
             raise ValueError("Invalid Options Type ", self.opt)
 
-        return self._bs(delta=delta, St=initSpot, N2=N2, pv_k=pv_k) * noShares
+        return self._bs_pv(delta=delta, St=initSpot, N2=N2, pv_k=pv_k) * noShares
+
+    """
+    Price + greeks in one call
+      * tree models: delta, gamma and theta from PV(i,j) at period 1 and 2 of the same backward induction,
+        vega and rho from the same engine and lattice size bumped by +/- bump
+      * BS: closed form
+      * units: theta per day, vega and rho per 1% change (same as theta(unit="day"), vega/rho(unit="pct"))
+    """
+
+    @logger
+    @cached
+    def price_greeks(self, initSpot, noShares=100, bump=0.01):
+        if self.model == "BS":
+            return self._bs_greeks(initSpot, noShares)
+
+        return self._extrapolate(lambda lattice: lattice._lattice_greeks(initSpot, noShares, bump))
+
+    def _lattice_greeks(self, initSpot, noShares=100, bump=0.01):
+        if self._start() < 2:
+            raise ValueError("Lattice greeks need at least 2 periods", self.n)
+
+        top = np.zeros((3, 3))
+        pv = self._engine_price(initSpot, noShares, top)
+
+        S1 = self.S(initSpot, totalDown=1)
+        S2 = self.S(initSpot, totalDown=2)
+        delta_down = (top[2][1] - top[2][0]) / (S2[1] - S2[0])
+        delta_up = (top[2][2] - top[2][1]) / (S2[2] - S2[1])
+
+        return {"price": pv,
+                "delta": (top[1][1] - top[1][0]) / (S1[1] - S1[0]),
+                "gamma": (delta_up - delta_down) / (0.5 * (S2[2] - S2[0])),
+                "theta": (top[2][1] - top[0][0]) / (2 * self.h) / 365,
+                "vega": self._bump_diff(initSpot, noShares, "std", bump),
+                "rho": self._bump_diff(initSpot, noShares, "r", bump)}
+
+    def _bs_greeks(self, initSpot, noShares=100):
+        return {"price": self._bs_price(initSpot, noShares),
+                "delta": self.delta(initSpot, noShares),
+                "gamma": self.gamma(initSpot, noShares),
+                "theta": self.theta(initSpot, noShares),
+                "vega": self.vega(initSpot, noShares),
+                "rho": self.rho(initSpot, noShares)}
+
+    def _bump_greeks(self, initSpot, noShares=100, bump=0.01):
+        # central differences of the engine price, e.g. for closed forms without analytic greeks
+        dS = initSpot * bump
+        pv = self._engine_price(initSpot, noShares)
+        pv_up = self._engine_price(initSpot + dS, noShares)
+        pv_down = self._engine_price(initSpot - dS, noShares)
+
+        return {"price": pv,
+                "delta": (pv_up - pv_down) / (2 * dS),
+                "gamma": (pv_up - 2 * pv + pv_down) / dS ** 2,
+                "theta": self._bumped(tenor=self.tenor - 1 / 365)._engine_price(initSpot, noShares) - pv,
+                "vega": self._bump_diff(initSpot, noShares, "std", bump),
+                "rho": self._bump_diff(initSpot, noShares, "r", bump)}
+
+    def _bump_diff(self, initSpot, noShares, param, bump):
+        # per 1% change
+        pv_up = self._bumped(**{param: getattr(self, param) + bump})._bump_price(initSpot, noShares)
+        pv_down = self._bumped(**{param: getattr(self, param) - bump})._bump_price(initSpot, noShares)
+        return 0.01 * (pv_up - pv_down) / (2 * bump)
+
+    def _bump_price(self, initSpot, noShares=100):
+        # price of a bumped lattice for vega and rho
+        return self._engine_price(initSpot, noShares)
+
+    def _bumped(self, **params):
+        # same contract, engine and lattice size with bumped parameters
+        clone = copy.copy(self)
+        clone.__dict__.update(params)
+        if clone.n is not None:
+            clone.h = clone.tenor / clone.n
+        clone._setup_model()
+        return clone
 
     def delta(self, initSpot, noShares=100):
         d1 = self.d1(initSpot, 0)
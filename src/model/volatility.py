@@ -0,0 +1,177 @@
+import numpy as np
+
+"""
+Historical volatility from DailyPrice close / high / low, for the std of the pricers (Vanilla, KnockoutOptions,
+KnockInOptions, BarrierMC, AccumulatorContract: annualized, 0.2 = 20%) and the volatility of FastSimulation
+(monthly, in percent).
+
+Prices are (days,) arrays, or (days x tickers) for a universe, ascending by date (Store.select_daily_price_columns
+with ascending=True, PriceCache.get, align). A missing price is NaN. Every estimator gives one variance term per day
+from the second day on (the first has no previous close), in daily units:
+    close:        ln(C(t)/C(t-1))^2                                   (zero mean)
+    parkinson:    ln(H(t)/L(t))^2 / (4 ln 2)
+    garman_klass: ln(H(t)/L(t))^2 / 2 - (2 ln 2 - 1) ln(C(t)/O(t))^2  with O(t) = C(t-1), DailyPrice has no open
+and the variance is the mean of the terms over a rolling window of days, or their EWMA
+    var(t) = lam * var(t-1) + (1 - lam) * term(t)    (RiskMetrics, var = term on the first day)
+A window with a missing term is NaN, the EWMA of a ticker starts on its first term and keeps its value over the
+missing days.
+
+VolatilityTracker keeps the state (last close, window of terms, EWMA) to update the estimate with a new day of prices
+without going through the history again.
+"""
+
+ESTIMATORS = ("close", "parkinson", "garman_klass")
+TRADING_DAYS = 252
+
+
+def _terms(close, previous_close, high, low, estimator):
+    # variance terms of the days of close, high and low
+    if estimator == "close":
+        return np.log(close / previous_close) ** 2
+    if estimator not in ESTIMATORS:
+        raise ValueError("Invalid estimator(close, parkinson or garman_klass)", estimator)
+    if high is None or low is None:
+        raise ValueError("high and low are needed for the estimator", estimator)
+
+    range_term = np.log(np.asarray(high, dtype=np.float64) / np.asarray(low, dtype=np.float64)) ** 2
+    if estimator == "parkinson":
+        return range_term / (4 * np.log(2))
+    return 0.5 * range_term - (2 * np.log(2) - 1) * np.log(close / previous_close) ** 2
+
+
+def daily_variances(close, high=None, low=None, estimator="close"):
+    # (days - 1) x ... variance terms of the days 1...days-1
+    close = np.asarray(close, dtype=np.float64)
+    return _terms(close[1:], close[:-1], None if high is None else np.asarray(high)[1:],
+                  None if low is None else np.asarray(low)[1:], estimator)
+
+
+def rolling(variances, window):
+    # mean of the last window terms, NaN until the window is full or when it has a missing term
+    if window <= 0:
+        raise ValueError("window should be positive", window)
+    variances = np.asarray(variances, dtype=np.float64)
+    valid = ~np.isnan(variances)
+    zero = np.zeros((1,) + variances.shape[1:])
+    sums = np.concatenate([zero, np.cumsum(np.where(valid, variances, 0.0), axis=0)])
+    counts = np.concatenate([zero, np.cumsum(valid, axis=0)])
+
+    result = np.full(variances.shape, np.nan)
+    if len(variances) >= window:
+        full = counts[window:] - counts[:-window] == window
+        result[window - 1:] = np.where(full, (sums[window:] - sums[:-window]) / window, np.nan)
+    return result
+
+
+def ewma(variances, lam=0.94, initial=None):
+    """
+    EWMA of the terms, vectorized across tickers
+    initial: variance before the first term (VolatilityTracker), None to start on the first term
+    """
+    if not 0 < lam < 1:
+        raise ValueError("lam should be in (0, 1)", lam)
+    variances = np.asarray(variances, dtype=np.float64)
+    result = np.empty(variances.shape)
+    current = np.full(variances.shape[1:], np.nan) if initial is None else np.asarray(initial, dtype=np.float64)
+    for t in range(len(variances)):
+        term = variances[t]
+        current = np.where(np.isnan(term), current,
+                           np.where(np.isnan(current), term, lam * current + (1 - lam) * term))
+        result[t] = current
+    return result
+
+
+def annualize(variance, periods=TRADING_DAYS):
+    # daily variance -> annualized std, the std of the pricers
+    return np.sqrt(np.asarray(variance) * periods)
+
+
+def to_monthly_percent(std, months=12):
+    # annualized std -> the volatility of FastSimulation / accu_sim (std of the monthly return in percent)
+    return np.asarray(std) / np.sqrt(months) * 100
+
+
+def historical_volatility(close, high=None, low=None, estimator="close", window=None, lam=None,
+                          periods=TRADING_DAYS):
+    """
+    Annualized volatility per day from the second day on, of a rolling window of days or an EWMA with lam
+    (one of them), (days - 1) x ... like the prices
+    """
+    if (window is None) == (lam is None):
+        raise ValueError("Either window or lam", window, lam)
+    variances = daily_variances(close, high, low, estimator)
+    return annualize(rolling(variances, window) if lam is None else ewma(variances, lam), periods)
+
+
+def align(universe, column="close"):
+    """
+    universe: {ticker: {"date", column...}} (Store.select_daily_price_universe, PriceCache.get) in any order
+    return: (dates, tickers, days x tickers array of the column, NaN where a ticker has no row), ascending by date
+    """
+    tickers = list(universe)
+    dates = np.unique(np.concatenate([np.asarray(universe[ticker]["date"]) for ticker in tickers])) \
+        if tickers else np.array([], dtype="datetime64[D]")
+    values = np.full((len(dates), len(tickers)), np.nan)
+    for i, ticker in enumerate(tickers):
+        values[np.searchsorted(dates, universe[ticker]["date"]), i] = universe[ticker][column]
+    return dates, tickers, values
+
+
+class VolatilityTracker:
+    def __init__(self, estimator="close", window=None, lam=None, periods=TRADING_DAYS):
+        """
+        Incremental historical_volatility: fit() on the history, then update() with every new day
+        window: rolling window of days, lam: EWMA (one of them)
+        """
+        if (window is None) == (lam is None):
+            raise ValueError("Either window or lam", window, lam)
+        if estimator not in ESTIMATORS:
+            raise ValueError("Invalid estimator(close, parkinson or garman_klass)", estimator)
+        if window is not None and window <= 0:
+            raise ValueError("window should be positive", window)
+        if lam is not None and not 0 < lam < 1:
+            raise ValueError("lam should be in (0, 1)", lam)
+
+        self.estimator = estimator
+        self.window = window
+        self.lam = lam
+        self.periods = periods
+        self.last_close = None
+        # last window terms, oldest first (rolling), or current variance (EWMA)
+        self.terms = None
+        self.variance = None
+
+    def fit(self, close, high=None, low=None):
+        # state from the history (days,) or (days x tickers), return: the annualized volatility of the last day
+        close = np.asarray(close, dtype=np.float64)
+        variances = daily_variances(close, high, low, self.estimator)
+        self.last_close = close[-1].copy()
+        if self.lam is None:
+            terms = np.full((self.window,) + close.shape[1:], np.nan)
+            count = min(self.window, len(variances))
+            if count:
+                terms[self.window - count:] = variances[len(variances) - count:]
+            self.terms = terms
+            self.variance = rolling(terms, self.window)[-1]
+        else:
+            self.variance = ewma(variances, self.lam)[-1] if len(variances) else np.full(close.shape[1:], np.nan)
+        return self.volatility
+
+    def update(self, close, high=None, low=None):
+        # one new day, scalars or (tickers,), return: the annualized volatility
+        if self.last_close is None:
+            raise ValueError("fit() the history first")
+
+        close = np.asarray(close, dtype=np.float64)
+        term = _terms(close, self.last_close, high, low, self.estimator)[None]
+        self.last_close = close.copy()
+        if self.lam is None:
+            self.terms = np.concatenate([self.terms[1:], term])
+            self.variance = rolling(self.terms, self.window)[-1]
+        else:
+            self.variance = ewma(term, self.lam, initial=self.variance)[-1]
+        return self.volatility
+
+    @property
+    def volatility(self):
+        return annualize(self.variance, self.periods)
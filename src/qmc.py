@@ -0,0 +1,84 @@
+import numpy as np
+from scipy.stats import norm, qmc
+
+"""
+Standard normal increments for path simulation from a pseudo-random or a quasi-random (scrambled Sobol) generator.
+
+Sobol points are only better than pseudo-random ones in their first dimensions, so with bridge=True the normals
+build the path with a Brownian bridge: the first dimension sets W at the end of the path, the next ones the midpoints
+of the intervals left (bisection), and the increments W(t+1) - W(t) are returned. They are iid N(0, 1) like the
+input, with most of the variance of the path carried by the first dimensions.
+
+The scrambled sequences of different seeds are independent randomizations of the same point set (randomized QMC),
+so the spread of the estimates over a few replications gives the error estimate plain QMC doesn't have. The balance
+properties of Sobol points need a power of 2 number of points per replication.
+"""
+
+GENERATORS = ("pseudo", "sobol")
+
+
+def bridge_order(dims):
+    """
+    Construction order of the Brownian bridge over W(1)...W(dims), W(0) = 0
+    return: (index, left, right) arrays, index filled at step k from W(left) and W(right), left = -1 for W(0)
+    """
+    index, left, right = [dims - 1], [-1], [-1]
+    intervals = [(-1, dims - 1)]
+    while intervals:
+        next_intervals = []
+        for lo, hi in intervals:
+            if hi - lo < 2:
+                continue
+            mid = (lo + hi + 1) // 2
+            index.append(mid)
+            left.append(lo)
+            right.append(hi)
+            next_intervals += [(lo, mid), (mid, hi)]
+        intervals = next_intervals
+    return np.array(index), np.array(left), np.array(right)
+
+
+def brownian_bridge(z):
+    # z: (paths x dims) iid N(0, 1) in construction order -> (paths x dims) iid N(0, 1) increments of W
+    paths, dims = z.shape
+    index, left, right = bridge_order(dims)
+    W = np.empty((paths, dims + 1))  # W[:, 0] = W(0), W[:, i + 1] = W(i + 1)
+    W[:, 0] = 0.0
+    for k, (i, lo, hi) in enumerate(zip(index, left, right)):
+        if hi == -1:
+            # end of the path
+            W[:, i + 1] = np.sqrt(dims) * z[:, k]
+            continue
+        t, t_lo, t_hi = i + 1, lo + 1, hi + 1
+        W[:, t] = ((t_hi - t) * W[:, t_lo] + (t - t_lo) * W[:, t_hi]) / (t_hi - t_lo) \
+            + np.sqrt((t - t_lo) * (t_hi - t) / (t_hi - t_lo)) * z[:, k]
+    return np.diff(W, axis=1)
+
+
+def normal_blocks(paths, dims, block_size, generator="pseudo", seed=1, bridge=True):
+    """
+    Yields (paths x dims) normals in blocks of at most block_size rows
+    generator: "pseudo" (np.random.default_rng(seed)) or "sobol" (scrambled with seed, paths a power of 2)
+    """
+    if generator == "pseudo":
+        rng = np.random.default_rng(seed)
+        for start in range(0, paths, block_size):
+            yield rng.standard_normal((min(block_size, paths - start), dims))
+    elif generator == "sobol":
+        if paths & (paths - 1) != 0:
+            raise ValueError("Sobol points should be a power of 2", paths)
+        engine = qmc.Sobol(d=dims, scramble=True, seed=np.random.default_rng(seed))
+        # power of 2 blocks keep every block balanced
+        block_size = 1 << (int(block_size).bit_length() - 1)
+        for start in range(0, paths, block_size):
+            u = engine.random(min(block_size, paths - start))
+            # a scrambled point is never 0, but keep ppf finite anyway
+            z = norm.ppf(np.clip(u, 1e-16, 1 - 1e-16))
+            yield brownian_bridge(z) if bridge else z
+    else:
+        raise ValueError("Invalid generator", generator)
+
+
+def replication_seeds(seed, replications):
+    # one independent randomization per replication
+    return np.random.SeedSequence(seed).spawn(replications)
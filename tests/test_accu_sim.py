@@ -0,0 +1,125 @@
+import unittest
+
+import numpy as np
+
+from src.accu_sim import FastSimulation, parallel_run, run_stats
+from src.accu_sweep import sweep, rerun_failed
+
+
+class MyTestCase(unittest.TestCase):
+    def test_parallel_run(self):
+        times = 20000
+        payoffs = parallel_run(times, 95, 105, 5, seed=7, workers=4)
+        self.assertEqual((times,), payoffs.shape)
+
+        # reproducible for the same seed and workers
+        self.assertTrue(np.array_equal(payoffs, parallel_run(times, 95, 105, 5, seed=7, workers=4)))
+        self.assertFalse(np.array_equal(payoffs, parallel_run(times, 95, 105, 5, seed=8, workers=4)))
+
+        # same distribution as the single threaded version
+        serial = np.asarray(FastSimulation(times, 95, 105, 5).run())
+        stderr = np.sqrt(payoffs.var() / times + serial.var() / times)
+        self.assertLess(abs(payoffs.mean() - serial.mean()), 4 * stderr)
+
+        self.assertRaises(ValueError, parallel_run, times, 95, 105, 5, 1, 0)
+
+    def test_run_stats(self):
+        times = 20000
+        out = np.empty(times)
+        stats = run_stats(times, 95, 105, 5, seed=7, workers=4, quantiles=(0.05, 0.5, 0.95), out=out)
+
+        # same paths as parallel_run
+        payoffs = parallel_run(times, 95, 105, 5, seed=7, workers=4)
+        self.assertTrue(np.array_equal(payoffs, out))
+
+        self.assertEqual(times, stats["paths"])
+        self.assertAlmostEqual(payoffs.mean(), stats["mean"], delta=1e-6)
+        self.assertAlmostEqual(payoffs.var(ddof=1) / stats["variance"], 1.0, 9)
+        self.assertAlmostEqual(np.sqrt(payoffs.var(ddof=1) / times), stats["stderr"], 6)
+
+        # knocked out at any settlement, vs an independent simulation of the same price model
+        prices = (np.random.default_rng(0).normal(0, 5, (times, 12)) / 100 + 1).cumprod(axis=1) * 100
+        expected = np.any(prices > 105, axis=1).mean()
+        self.assertLess(abs(expected - stats["knock_out_freq"]), 4 * np.sqrt(2 * expected * (1 - expected) / times))
+
+        # P-square estimates vs the exact quantiles
+        spread = np.quantile(payoffs, 0.95) - np.quantile(payoffs, 0.05)
+        for p, estimate in stats["quantiles"].items():
+            self.assertLess(abs(np.quantile(payoffs, p) - estimate), 0.02 * spread)
+
+        self.assertRaises(ValueError, run_stats, times, 95, 105, 5, 1, 4, (0.5, 1.0))
+        self.assertRaises(ValueError, run_stats, times, 95, 105, 5, 1, 4, (), np.empty(times - 1))
+
+    def test_variance_reduction(self):
+        times = 40000
+        reference = run_stats(400000, 95, 105, 5, seed=1, workers=4)
+        self.assertAlmostEqual(1.0, reference["variance_reduction"], 6)
+
+        for options in [dict(antithetic=True), dict(control=True), dict(strata=16),
+                        dict(antithetic=True, control=True, strata=16)]:
+            stats = run_stats(times, 95, 105, 5, seed=2, workers=4, **options)
+            self.assertEqual(times, stats["paths"])
+            self.assertLess(abs(stats["mean"] - reference["mean"]), 4 * np.hypot(stats["stderr"], reference["stderr"]))
+            self.assertGreater(stats["variance_reduction"], 1.0)
+
+        # the reported stderr matches the spread of independent runs
+        means, stderrs = zip(*[(stats["mean"], stats["stderr"]) for stats in
+                               [run_stats(10000, 95, 105, 5, seed=seed, workers=2, antithetic=True, control=True,
+                                          strata=8) for seed in range(20)]])
+        self.assertTrue(0.6 < np.std(means, ddof=1) / np.mean(stderrs) < 1.5)
+
+        self.assertRaises(ValueError, run_stats, times + 1, 95, 105, 5, 1, 4, antithetic=True)
+        self.assertRaises(ValueError, run_stats, times, 95, 105, 5, 1, 4, strata=times)
+
+    def test_sobol_generator(self):
+        times = 2 ** 14
+        reference = run_stats(400000, 95, 105, 5, seed=1, workers=4)
+        out = np.empty(times)
+        stats = run_stats(times, 95, 105, 5, seed=2, generator="sobol", replications=16, out=out)
+
+        self.assertEqual(times, stats["paths"])
+        self.assertAlmostEqual(out.mean(), stats["mean"], delta=1e-6)
+        self.assertLess(abs(stats["mean"] - reference["mean"]), 4 * np.hypot(stats["stderr"], reference["stderr"]))
+        self.assertGreater(stats["variance_reduction"], 4.0)
+        # workers only sets the threads of the kernel
+        single = run_stats(times, 95, 105, 5, seed=2, generator="sobol", replications=16, workers=1)
+        self.assertEqual(stats["mean"], single["mean"])
+        self.assertEqual(stats["stderr"], single["stderr"])
+
+        self.assertRaises(ValueError, run_stats, 1000, 95, 105, 5, generator="sobol")
+        self.assertRaises(ValueError, run_stats, times, 95, 105, 5, generator="sobol", antithetic=True)
+        self.assertRaises(ValueError, run_stats, times, 95, 105, 5, generator="halton")
+
+    def test_sweep(self):
+        updates = []
+        result = sweep([3, 5], [3, 5], [2, 5], times=5000, seed=3, processes=2,
+                       progress=lambda done, total, row: updates.append((done, total, int(row['cell']))))
+
+        self.assertEqual(8, len(result))
+        self.assertTrue(np.all(result['ok']))
+        self.assertEqual([(i + 1, 8) for i in range(8)], [update[:2] for update in updates])
+        self.assertEqual(list(range(8)), sorted(update[2] for update in updates))
+
+        # cell (K=5, k=3, sigma=2) is the same run_stats() run: seeded with (seed, cell)
+        row = result[(result['strike_offset'] == 5) & (result['knock_out_offset'] == 3) & (result['volatility'] == 2)]
+        stats = run_stats(5000, 95, 103, 2, seed=(3, int(row['cell'][0])), workers=1)
+        self.assertEqual(stats["mean"], row['value'][0])
+        self.assertEqual(stats["stderr"], row['stderr'][0])
+
+        # only the failed cells are run again
+        failed = result.copy()
+        failed['ok'][[1, 6]] = False
+        failed['value'][[1, 6]] = np.nan
+        updates.clear()
+        rerun = rerun_failed(failed, times=5000, seed=3, processes=1,
+                             progress=lambda done, total, row: updates.append((done, total, int(row['cell']))))
+        self.assertEqual([(1, 2), (2, 2)], [update[:2] for update in updates])
+        self.assertEqual([1, 6], sorted(update[2] for update in updates))
+        self.assertTrue(np.array_equal(result, rerun))
+
+        reduced = sweep([3], [3], [5], times=5000, processes=1, antithetic=True, control=True)
+        self.assertGreater(reduced['variance_reduction'][0], 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
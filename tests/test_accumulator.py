@@ -0,0 +1,56 @@
+import unittest
+
+import numpy as np
+
+from src.accu_sim import _accumulate
+from src.accumulator import AccumulatorContract, evaluate, simulate
+
+
+class MyTestCase(unittest.TestCase):
+    def test_fast_simulation_contract(self):
+        # monthly observation = settlement, no drift: same payoff as accu_sim for the same prices
+        contract = AccumulatorContract(strike=95, knock_out=105, std=0.2, observations=1)
+        prices = (np.random.default_rng(0).normal(0, 5, (2000, 12)) / 100 + 1).cumprod(axis=1) * 100
+        payoffs, knocked_out = evaluate(contract, prices)
+
+        expected = np.array([_accumulate(path, 95.0, 105.0) for path in prices])
+        np.testing.assert_allclose(payoffs, expected, rtol=1e-12, atol=1e-6)
+        np.testing.assert_array_equal(knocked_out, np.any(prices > 105, axis=1))
+
+    def test_simulate(self):
+        contract = AccumulatorContract(strike=95, knock_out=105, std=0.2, observations=21, guaranteed=2)
+        paths = 20000
+
+        # the block size only bounds the memory
+        out = np.empty(paths)
+        stats = simulate(contract, paths, block_size=3000, seed=5, out=out)
+        single = np.empty(paths)
+        simulate(contract, paths, block_size=paths, seed=5, out=single)
+        np.testing.assert_allclose(single, out, rtol=1e-12)
+        self.assertAlmostEqual(out.mean(), stats["mean"], delta=1e-6)
+        self.assertAlmostEqual(np.sqrt(out.var(ddof=1) / paths), stats["stderr"], 6)
+
+        # never terminated over guaranteed periods, so at least as many shares as without them
+        guaranteed = AccumulatorContract(strike=95, knock_out=105, std=0.2, observations=21, guaranteed=12)
+        self.assertEqual(0.0, simulate(guaranteed, paths, seed=5)["knock_out_freq"])
+        self.assertLess(stats["knock_out_freq"],
+                        simulate(AccumulatorContract(95, 105, 0.2, observations=21), paths, seed=5)["knock_out_freq"])
+
+        # gearing only scales the shares bought below the strike
+        prices = np.full((1, contract.days), 90.0)
+        geared = AccumulatorContract(strike=95, knock_out=105, std=0.2, observations=21, gearing=3)
+        self.assertAlmostEqual(1.5 * evaluate(contract, prices)[0][0], evaluate(geared, prices)[0][0], 6)
+
+        # randomized QMC: the stderr comes from the replications
+        sobol = simulate(contract, 2 ** 14, block_size=4096, seed=5, generator="sobol", replications=16)
+        self.assertLess(abs(sobol["mean"] - stats["mean"]), 4 * np.hypot(sobol["stderr"], stats["stderr"]))
+        self.assertLess(sobol["stderr"], np.sqrt(sobol["variance"] / 2 ** 14))
+        self.assertRaises(ValueError, simulate, contract, 2 ** 14, generator="sobol", replications=1)
+
+        self.assertRaises(ValueError, AccumulatorContract, 105, 95, 0.2)
+        self.assertRaises(ValueError, AccumulatorContract, 95, 105, 0.2, guaranteed=13)
+        self.assertRaises(ValueError, simulate, contract, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
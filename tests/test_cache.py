@@ -0,0 +1,73 @@
+import shutil
+import tempfile
+import unittest
+from datetime import date, timedelta
+
+import numpy as np
+
+from src.data.cache import PriceCache
+
+
+class FakeStore:
+    # in-memory DailyPrice rows of one ticker, ascending reads only
+    def __init__(self, closes):
+        self.closes = dict(closes)
+        self.listeners = []
+        self.reads = []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def update(self, ticker, day, close):
+        self.closes[day] = close
+        for listener in self.listeners:
+            listener(ticker, day, day)
+
+    def select_daily_price_columns(self, ticker, fromDate, toDate, exclude=False, columns=None, fetch_size=5000,
+                                   ascending=False, as_frame=False):
+        self.reads.append((fromDate, toDate))
+        days = sorted(day for day in self.closes if fromDate <= day <= toDate)
+        result = {"date": np.array(days, dtype="datetime64[D]"),
+                  "close": np.array([self.closes[day] for day in days], dtype=np.float64)}
+        return {name: result[name] for name in columns}
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_incremental_refresh(self):
+        start = date(2015, 1, 1)
+        store = FakeStore({start + timedelta(days=i): 100.0 + i for i in range(10)})
+        cache = PriceCache(self.directory, store, columns=("date", "close"))
+
+        prices = cache.get("test")
+        np.testing.assert_array_equal(100.0 + np.arange(10), prices["close"])
+        self.assertIsInstance(prices["close"], np.memmap)
+        self.assertEqual(start + timedelta(days=9), cache.high_water("test"))
+
+        # only the rows after the high-water date are fetched
+        store.closes[start + timedelta(days=10)] = 110.0
+        prices = cache.get("test", fromDate=start + timedelta(days=8))
+        np.testing.assert_array_equal([108.0, 109.0, 110.0], prices["close"])
+        self.assertEqual(start + timedelta(days=10), store.reads[-1][0])
+
+        # an update through the store drops the cached rows from its date on
+        store.update("test", start + timedelta(days=5), 55.0)
+        self.assertEqual(start + timedelta(days=4), cache.high_water("test"))
+        prices = cache.get("test", toDate=start + timedelta(days=6), exclude=True)
+        np.testing.assert_array_equal([100.0, 101.0, 102.0, 103.0, 104.0, 55.0], prices["close"])
+        self.assertEqual(start + timedelta(days=5), store.reads[-1][0])
+
+        # offline: what's cached, and nothing for the others
+        offline = PriceCache(self.directory, columns=("date", "close"))
+        np.testing.assert_array_equal(cache.get("test", refresh=False)["close"], offline.get("test")["close"])
+        self.assertRaises(ValueError, offline.get, "other")
+        self.assertRaises(ValueError, PriceCache, self.directory, columns=("date", "name"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,13 +13,20 @@ from cassandra.query import named_tuple_factory
 import uuid
 from cassandra.cqlengine import columns, ValidationError
 from cassandra.cqlengine import connection
-from datetime import datetime
+from datetime import datetime, date
 from cassandra.cqlengine.management import sync_table
 from cassandra.cqlengine.models import Model
 import sys, inspect
+import threading
+import time
+import weakref
+import numpy as np
+from cassandra.util import Date
+from src.data.model.daily_price import DailyPrice, DailyPriceByYear
 
 from src.data.model.daily_price import Currency
-from src.data.store import Store
+from src.data.store import Store, BatchError, partition_batches, execute_with_retries, to_columns, column_dtype, \
+    PRICE_COLUMNS, year_buckets
 
 
 class TestCassandra(unittest.TestCase):
@@ -159,6 +166,416 @@ class TestCassandra(unittest.TestCase):
 
         store.drop_daily_price_table()
 
+    def test_partition_batches(self):
+        Row = collections.namedtuple('Row', ['ticker', 'date'])
+        rows = [Row('a', 1), Row('b', 1), Row('a', 2), Row('a', 3), Row('b', 2), Row('a', 4), Row('a', 5)]
+        batches = partition_batches(rows, 2)
+
+        # never more than batch_size rows, never across partitions, every row once in input order
+        self.assertEqual([[('a', 1), ('a', 2)], [('a', 3), ('a', 4)], [('a', 5)], [('b', 1), ('b', 2)]],
+                         [[tuple(row) for row in batch] for batch in batches])
+        self.assertEqual([], partition_batches([], 10))
+        self.assertRaises(ValueError, partition_batches, rows, 0)
+
+    def test_execute_with_retries(self):
+        # statement i fails its first failures[i] attempts
+        failures = {0: 0, 1: 1, 2: 5}
+        attempts = collections.Counter()
+
+        def execute(statements):
+            results = []
+            for statement in statements:
+                attempts[statement] += 1
+                ok = attempts[statement] > failures[statement]
+                results.append((ok, None if ok else RuntimeError(statement)))
+            return results
+
+        errors = execute_with_retries(execute, [0, 1, 2], retries=2)
+        self.assertEqual([2], list(errors))
+        self.assertIsInstance(errors[2], RuntimeError)
+        # succeeded ones aren't executed again
+        self.assertEqual({0: 1, 1: 2, 2: 3}, dict(attempts))
+
+    def test_batch_delete_errors(self):
+        # range deletes of a store without a cluster, the ones of ticker 'bad' always fail
+        class DeleteStore(Store):
+            def __init__(self):
+                self.bucketed, self.listeners, self.executed = False, [], []
+
+            def prepare(self, cql):
+                return cql
+
+            def execute_concurrent(self, statements, concurrency=64, retries=3):
+                self.executed += statements
+                return {i: RuntimeError(parameters[0]) for i, (statement, parameters) in enumerate(statements)
+                        if parameters[0] == 'bad'}
+
+        DeleteCriterion = collections.namedtuple('DeleteCriterion', ['ticker', 'fromDate', 'toDate'])
+        ranges = [DeleteCriterion('test', date(2015, 1, 1), date(2015, 2, 1)),
+                  DeleteCriterion('bad', date(2015, 1, 1), date(2015, 2, 1))]
+
+        store = DeleteStore()
+        self.assertIsNone(store.batch_delete_daily_price(ranges[:1]))
+        with self.assertRaises(BatchError) as raised:
+            store.batch_delete_daily_price(ranges)
+        self.assertEqual(['bad'], [ticker for ticker, error in raised.exception.errors])
+        self.assertEqual(['bad'], [ticker for ticker, error in
+                                   store.batch_delete_daily_price(ranges, return_errors=True)])
+
+        # an invalid range: the ones before it only run with execute_on_exception
+        store = DeleteStore()
+        self.assertRaises(AttributeError, store.batch_delete_daily_price, [ranges[0], None])
+        self.assertEqual([], store.executed)
+        self.assertRaises(AttributeError, store.batch_delete_daily_price, [ranges[0], None], True)
+        self.assertEqual(['test'], [parameters[0] for statement, parameters in store.executed])
+
+    def test_update_dates(self):
+        # the UPDATE ... date IN of a store without a cluster, only the dates of the range are written
+        updates = []
+
+        class Query:
+            def __init__(self, where):
+                self.where = where
+
+            def batch(self, batch):
+                return self
+
+            def update(self, **kwargs):
+                updates.append((self.where['date__in'], kwargs))
+
+        class Objects:
+            def filter(self, **where):
+                return Query(where)
+
+        class UpdateModel:
+            objects = Objects()
+
+        class UpdateStore(Store):
+            def __init__(self):
+                self.bucketed, self.listeners, self.model, self.key_columns = False, [], UpdateModel, ('ticker',)
+
+        store = UpdateStore()
+        dates = [date(2015, 1, day) for day in range(1, 11)]
+        store.update_daily_price('test', date(2015, 1, 3), date(2015, 1, 5), dates=dates, close=77)
+        store.update_daily_price('test', date(2015, 1, 3), date(2015, 1, 5), exclude=True, dates=dates, close=66)
+        store.update_daily_price('test', None, date(2015, 1, 2), dates=dates, close=55)
+        store.update_daily_price('test', date(2015, 2, 1), None, dates=dates, close=44)
+        self.assertEqual([([date(2015, 1, day) for day in (3, 4, 5)], {'close': 77}),
+                          ([date(2015, 1, day) for day in (3, 4)], {'close': 66}),
+                          ([date(2015, 1, day) for day in (1, 2)], {'close': 55})], updates)
+
+    def test_batch_listeners(self):
+        # the listeners of batched writes are told once per ticker after the batch has run
+        class Batch:
+            def __init__(self):
+                self.callbacks = []
+
+            def add_callback(self, fn, *args):
+                self.callbacks.append((fn, args))
+
+            def execute(self):
+                for fn, args in self.callbacks:
+                    fn(*args)
+
+        class Query:
+            def filter(self, **where):
+                return self
+
+            def batch(self, batch):
+                return self
+
+            def create(self, **kwargs):
+                pass
+
+            def update(self, **kwargs):
+                pass
+
+        class BatchModel:
+            objects = Query()
+
+            @classmethod
+            def batch(cls, batch):
+                return Query()
+
+        class ListenedStore(Store):
+            def __init__(self):
+                self.bucketed, self.listeners, self.model, self.key_columns = False, [], BatchModel, ('ticker',)
+                self._batched = weakref.WeakKeyDictionary()
+
+        store = ListenedStore()
+        changes = []
+        store.add_listener(lambda ticker, fromDate, toDate: changes.append((ticker, fromDate, toDate)))
+        batch = Batch()
+        for day in (5, 2, 9):
+            store.insert_daily_price('test', date(2015, 1, day), 'test', 'USD', 'USA', 100, 110, 98, batch=batch)
+        store.insert_daily_price('test2', date(2015, 1, 3), 'test2', 'USD', 'USA', 100, 110, 98, batch=batch)
+        store.update_daily_price('test', None, None, batch=batch, dates=[date(2015, 1, 12)], close=77)
+        self.assertEqual([], changes)
+
+        batch.execute()
+        self.assertEqual([('test', date(2015, 1, 2), date(2015, 1, 12)), ('test2', date(2015, 1, 3), date(2015, 1, 3))],
+                         changes)
+
+        # without a batch, right away
+        store.insert_daily_price('test', date(2015, 1, 20), 'test', 'USD', 'USA', 100, 110, 98)
+        self.assertEqual(('test', date(2015, 1, 20), date(2015, 1, 20)), changes[-1])
+
+    @pytest.mark.skip(reason="Integration test only")
+    def test_bulk_insert(self):
+        store = Store(hosts=['192.168.56.1'], keyspace='perfmonitor')
+        DailyPriceData = collections.namedtuple('DailyPriceData', ['ticker',
+                                                                   'date',
+                                                                   'name',
+                                                                   'ccy',
+                                                                   'country',
+                                                                   'close',
+                                                                   'high',
+                                                                   'low'])
+        start = datetime.strptime('01/01/2015', '%d/%m/%Y').date()
+        data = [DailyPriceData(ticker=ticker,
+                               date=date.fromordinal(start.toordinal() + i),
+                               name=ticker,
+                               ccy='USD',
+                               country='USA',
+                               close=100 + i,
+                               high=110 + i,
+                               low=98 + i
+                               ) for ticker in ['test', 'test2'] for i in range(1000)]
+
+        stats = store.bulk_insert_daily_price(data, batch_size=50, concurrency=32)
+        print()
+        print(stats["rows"], "rows in", stats["seconds"], "s,", stats["rows_per_sec"], "rows/s")
+        self.assertEqual(stats["rows"], 2000)
+        self.assertEqual(stats["batches"], 40)
+        self.assertEqual(stats["failed_rows"], 0)
+
+        rows = store.select_daily_price_by_range(ticker='test2',
+                                                 fromDate=start,
+                                                 toDate=date.fromordinal(start.toordinal() + 9))
+        self.assertEqual(rows.count(), 10)
+        self.assertEqual(rows[0].currency.code, 'USD')
+
+        store.drop_daily_price_table()
+
+    @pytest.mark.skip(reason="Integration test only")
+    def test_range_update_delete(self):
+        store = Store(hosts=['192.168.56.1'], keyspace='perfmonitor')
+        for day in range(1, 11):
+            store.insert_daily_price(ticker='test', date=date(2015, 1, day), name='test', ccy='USD', country='USA',
+                                     close=100, high=110, low=98)
+
+        # dates read first, exclude leaves toDate out
+        store.update_daily_price('test', date(2015, 1, 1), date(2015, 1, 5), exclude=True, close=66)
+        closes = {row.date: row.close for row in
+                  store.select_daily_price_by_range('test', date(2015, 1, 1), date(2015, 1, 10))}
+        self.assertEqual([66] * 4 + [100] * 6, [closes[date(2015, 1, day)] for day in range(1, 11)])
+
+        # known dates, no read
+        store.update_daily_price('test', None, None, dates=[date(2015, 1, 9), date(2015, 1, 10)], close=77)
+        self.assertEqual([77, 77], [row.close for row in
+                                    store.select_daily_price_by_range('test', date(2015, 1, 9), date(2015, 1, 10))])
+
+        DeleteCriterion = collections.namedtuple('DeleteCriterion', ['ticker', 'fromDate', 'toDate', 'exclude'])
+        errors = store.batch_delete_daily_price([DeleteCriterion('test', date(2015, 1, 1), date(2015, 1, 5), True),
+                                                 DeleteCriterion('test', date(2015, 1, 8), date(2015, 1, 10), False)],
+                                                return_errors=True)
+        self.assertEqual([], errors)
+        self.assertEqual([date(2015, 1, day) for day in range(7, 4, -1)],
+                         store.select_daily_price_dates('test', date(2015, 1, 1), date(2015, 1, 10)))
+
+        store.drop_daily_price_table()
+
+    def test_to_columns(self):
+        names = PRICE_COLUMNS + ('year', 'name', 'updated_at')
+        dtypes = [column_dtype(DailyPrice._columns[name]) for name in names]
+        rows = [(Date(date(2015, 1, 2)), 100.0, 110.0, None, 2015, 'test', datetime(2015, 1, 2, 18)),
+                (Date(date(2015, 1, 1)), 99.0, 101.0, 98.0, 2015, 'test', None)]
+        result = to_columns(rows, names, dtypes)
+
+        np.testing.assert_array_equal(np.array(['2015-01-02', '2015-01-01'], dtype='datetime64[D]'), result['date'])
+        np.testing.assert_array_equal([100.0, 99.0], result['close'])
+        np.testing.assert_array_equal([np.nan, 98.0], result['low'])
+        self.assertEqual(np.int64, result['year'].dtype)
+        self.assertEqual(['test', 'test'], list(result['name']))
+        self.assertTrue(np.isnat(result['updated_at'][1]))
+        self.assertTrue(all(result[name].flags['C_CONTIGUOUS'] for name in names))
+
+        empty = to_columns([], PRICE_COLUMNS, dtypes[:4])
+        self.assertEqual([0] * 4, [len(empty[name]) for name in PRICE_COLUMNS])
+
+    @pytest.mark.skip(reason="Integration test only")
+    def test_select_columns(self):
+        store = Store(hosts=['192.168.56.1'], keyspace='perfmonitor')
+        for day in range(1, 11):
+            store.insert_daily_price(ticker='test', date=date(2015, 1, day), name='test', ccy='USD', country='USA',
+                                     close=100 + day, high=110, low=98)
+
+        # pages of 3 rows, toDate excluded
+        pages = list(store.iter_daily_price_columns('test', date(2015, 1, 1), date(2015, 1, 10), exclude=True,
+                                                    fetch_size=3))
+        self.assertEqual([3, 3, 3], [len(page['date']) for page in pages])
+
+        prices = store.select_daily_price_columns('test', date(2015, 1, 1), date(2015, 1, 10),
+                                                  columns=('date', 'close'), ascending=True)
+        self.assertEqual(['date', 'close'], list(prices))
+        np.testing.assert_array_equal(np.arange(101, 111), prices['close'])
+
+        frame = store.select_daily_price_columns('test', date(2015, 1, 1), date(2015, 1, 10), as_frame=True)
+        self.assertEqual(list(PRICE_COLUMNS), list(frame.columns))
+        self.assertEqual(np.datetime64('2015-01-10'), frame['date'].iloc[0])
+
+        store.drop_daily_price_table()
+
+    def test_year_buckets(self):
+        self.assertEqual([2016, 2015, 2014], year_buckets(date(2014, 5, 1), date(2016, 1, 1)))
+        self.assertEqual([2014, 2015, 2016], year_buckets(date(2014, 5, 1), date(2016, 1, 1), ascending=True))
+        self.assertEqual([2015], year_buckets(date(2015, 1, 1), date(2015, 12, 31)))
+        # clipped to the years that can hold rows
+        self.assertEqual([1970, 1971], year_buckets(date(1, 1, 1), date.max, ascending=True, first=1970, last=1971))
+        self.assertEqual([], year_buckets(date(2015, 1, 1), date(2016, 1, 1), first=2017))
+
+        # a bucketed batch never spans years
+        Row = collections.namedtuple('Row', ['ticker', 'date'])
+        rows = [Row('a', date(2014, 12, 30)), Row('a', date(2014, 12, 31)), Row('a', date(2015, 1, 2))]
+        batches = partition_batches(rows, 50, key=lambda row: (row.ticker, row.date.year))
+        self.assertEqual([2, 1], [len(batch) for batch in batches])
+
+    def test_bucketed_in_flight(self):
+        # columnar reads of a bucketed store without a cluster: 2 pages per year, close = year
+        test = self
+
+        class Result:
+            def __init__(self, session, year):
+                self.session, self.year, self.pages = session, year, 2
+                self.current_rows = [(Date(date(year, 1, 1)), float(year))]
+
+            @property
+            def has_more_pages(self):
+                if self.pages == 1:
+                    self.session.in_flight -= 1
+                return self.pages > 1
+
+            def fetch_next_page(self):
+                self.pages -= 1
+
+        class Future:
+            def __init__(self, result):
+                self._result = result
+
+            def result(self):
+                return self._result
+
+        class Session:
+            def __init__(self):
+                self.in_flight, self.max_in_flight, self.years = 0, 0, []
+
+            def execute_async(self, statement, execution_profile):
+                test.assertEqual('columnar', execution_profile)
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                self.years.append(statement[1])
+                return Future(Result(self, statement[1]))
+
+        class Bound(tuple):
+            pass
+
+        class Prepared:
+            def bind(self, parameters):
+                return Bound(parameters)
+
+        class BucketedStore(Store):
+            def __init__(self):
+                self.bucketed, self.key_columns, self.model = True, ('ticker', 'year'), DailyPriceByYear
+                self.workers, self.years, self._session = 3, (2000, 2009), Session()
+
+            @property
+            def session(self):
+                return self._session
+
+            def prepare(self, cql):
+                return Prepared()
+
+        store = BucketedStore()
+        prices = store.select_daily_price_columns('test', date(1970, 1, 1), date.max, columns=('date', 'close'))
+        # only the years that can hold rows, DESC, at most workers of them in flight
+        self.assertEqual(list(range(2009, 1999, -1)), store.session.years)
+        np.testing.assert_array_equal(np.repeat(np.arange(2009.0, 1999.0, -1), 2), prices['close'])
+        self.assertEqual(3, store.session.max_in_flight)
+
+        store = BucketedStore()
+        store.select_daily_price_columns('test', date(1970, 1, 1), date.max, columns=('date', 'close'),
+                                         ascending=True, in_flight=1)
+        self.assertEqual(list(range(2000, 2010)), store.session.years)
+        self.assertEqual(1, store.session.max_in_flight)
+
+        # nothing to read
+        empty = BucketedStore().select_daily_price_columns('test', date(1970, 1, 1), date(1980, 1, 1))
+        self.assertEqual([0] * 4, [len(empty[name]) for name in PRICE_COLUMNS])
+
+    @pytest.mark.skip(reason="Integration test only")
+    def test_bucketed(self):
+        store = Store(hosts=['192.168.56.1'], keyspace='perfmonitor', bucketed=True)
+        start = date(2014, 12, 1)
+        for i in range(60):
+            store.insert_daily_price(ticker='test', date=date.fromordinal(start.toordinal() + i), name='test',
+                                     ccy='USD', country='USA', close=100 + i, high=110, low=98)
+
+        # across the 2014 and 2015 partitions, merged in date order
+        rows = store.select_daily_price_rows('test', date(2014, 12, 20), date(2015, 1, 10))
+        self.assertEqual(22, len(rows))
+        self.assertEqual(sorted([row.date for row in rows], reverse=True), [row.date for row in rows])
+        self.assertEqual(22, store.select_daily_price_by_range('test', date(2014, 12, 20), date(2015, 1, 10)).count())
+
+        prices = store.select_daily_price_columns('test', date(2014, 12, 20), date(2015, 1, 10), ascending=True,
+                                                  fetch_size=5)
+        np.testing.assert_array_equal(np.arange(119, 141), prices['close'])
+
+        store.update_daily_price('test', date(2014, 12, 31), date(2015, 1, 1), close=66)
+        store.delete_daily_price('test', date(2014, 12, 1), date(2015, 1, 1), exclude=True)
+        self.assertEqual([66], [row.close for row in
+                                store.select_daily_price_rows('test', date(2014, 12, 1), date(2015, 1, 1))])
+
+        store.drop_daily_price_table()
+
+    def test_select_universe(self):
+        # the per ticker reads of a store without a cluster
+        class UniverseStore(Store):
+            def __init__(self):
+                self.in_flight, self.max_in_flight = 0, 0
+                self.lock = threading.Lock()
+                self.partitions_in_flight = set()
+
+            def select_daily_price_columns(self, ticker, *args):
+                self.partitions_in_flight.add(args[-1])
+                with self.lock:
+                    self.in_flight += 1
+                    self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                time.sleep(0.01)
+                with self.lock:
+                    self.in_flight -= 1
+                if ticker.startswith('bad'):
+                    raise RuntimeError(ticker)
+                return {'close': np.array([float(len(ticker))])}
+
+        store = UniverseStore()
+        tickers = ['t' * i for i in range(1, 21)] + ['bad1', 'bad2']
+        results, errors = store.select_daily_price_universe(tickers, date(2015, 1, 1), date(2015, 12, 31),
+                                                            concurrency=4)
+
+        self.assertEqual(tickers[:20], list(results))
+        self.assertEqual([1.0], list(results['t']['close']))
+        self.assertEqual(['bad1', 'bad2'], list(errors))
+        self.assertIsInstance(errors['bad1'], RuntimeError)
+        self.assertLessEqual(store.max_in_flight, 4)
+        # one partition request per ticker, concurrency in total
+        self.assertEqual({1}, store.partitions_in_flight)
+
+        # streamed as they complete, stopping early is fine
+        stream = store.iter_daily_price_universe(tickers, date(2015, 1, 1), date(2015, 12, 31), concurrency=2)
+        ticker, result, error = next(stream)
+        self.assertIn(ticker, tickers)
+        stream.close()
+
 
 if __name__ == '__main__':
     unittest.main()
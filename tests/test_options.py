@@ -4,10 +4,15 @@ import math
 import numpy as np
 from py_vollib.black_scholes import black_scholes as bs
 from py_vollib.black_scholes.greeks.analytical import delta, gamma, vega, theta, rho
+from py_vollib.black_scholes.implied_volatility import implied_volatility
 import matplotlib.pyplot as plt
 
 from src.model.european.barrier_knockin import KnockInOptions
+from src.model.european import black_scholes, barrier_analytic
 from src.model.european.barrier_knockout import KnockoutOptions
+from src.model.european.barrier_mc import BarrierMC
+from src.model.european.cache import PricingCache
+from src.model.european.implied_vol import implied_vol, implied_vol_lattice
 from src.model.european.vanilla import Vanilla
 
 
@@ -319,5 +324,391 @@ class MyTestCase(unittest.TestCase):
             f_pv = fast.price(initSpot=spot, noShares=shares)
             self.assertAlmostEqual(s_pv, f_pv)
 
+    def test_bs_batch_price(self):
+        rng = np.random.default_rng(7)
+        size = 200
+        contracts = np.zeros(size, dtype=black_scholes.CONTRACT_DTYPE)
+        contracts['spot'] = rng.uniform(50, 150, size)
+        contracts['strike'] = rng.uniform(50, 150, size)
+        contracts['r'] = rng.uniform(0.0, 0.1, size)
+        contracts['std'] = rng.uniform(0.05, 0.8, size)
+        contracts['tenor'] = rng.uniform(0.1, 3.0, size)
+        contracts['opt'] = np.where(rng.random(size) < 0.5, "call", "put")
+
+        batch = black_scholes.price_contracts(contracts, noShares=1)
+        for contract, pv in zip(contracts, batch):
+            bs_model = Vanilla("BS",
+                               r=contract['r'],
+                               std=contract['std'],
+                               tenor=contract['tenor'],
+                               n=None,
+                               strike=contract['strike'],
+                               opt=str(contract['opt']),
+                               model="BS")
+            self.assertEqual(bs_model._bs_price(contract['spot'], 1), pv)
+
+        self.assertRaises(ValueError, black_scholes.price, 100.0, 100.0, 0.01, 0.2, 1.0, ["call", "cal"])
+
+    def test_knockin_fast_slow_version(self):
+        risk_free_rate = math.log(1 + 0.01)
+        vol = math.log(1 + 0.3)
+        T = 1.0
+        for move, opt, spot, K, H in [("up", "call", 100.0, 95.0, 105.0), ("down", "put", 95.0, 100.0, 92.0)]:
+            for N in [3, 50, 200]:
+                slow = KnockInOptions("Knock-In", r=risk_free_rate, std=vol, tenor=T, n=N, strike=K, opt=opt,
+                                      barrier=H, move=move, fast=False)
+                fast = KnockInOptions("Knock-In", r=risk_free_rate, std=vol, tenor=T, n=N, strike=K, opt=opt,
+                                      barrier=H, move=move, fast=True)
+                self.assertAlmostEqual(slow.price(initSpot=spot, noShares=1), fast.price(initSpot=spot, noShares=1))
+
+    def test_knockin_knockout_parity_large_n(self):
+        risk_free_rate = math.log(1 + 0.01)
+        vol = math.log(1 + 0.3)
+        N = 10000
+        spot = 100.0
+        K = 95.0
+        T = 1.0
+        H = 105.0
+
+        knock_in = KnockInOptions("Up-And-In Call", r=risk_free_rate, std=vol, tenor=T, n=N, strike=K, opt="call",
+                                  barrier=H, move="up", fast=True)
+        knock_out = KnockoutOptions("Up-And-out Call", r=risk_free_rate, std=vol, tenor=T, n=N, strike=K,
+                                    opt="call", barrier=H, move="up", fast=True)
+        vanilla = Vanilla("Vanilla Call", r=risk_free_rate, std=vol, tenor=T, n=N, strike=K, opt="call", fast=True)
+
+        knock_in_pv = knock_in.price(initSpot=spot, noShares=1)
+        knock_out_pv = knock_out.price(initSpot=spot, noShares=1)
+        self.assertAlmostEqual(knock_out_pv + knock_in_pv, vanilla.price(initSpot=spot, noShares=1))
+
+    def test_fast_version_all_models(self):
+        risk_free_rate = math.log(1 + 0.06)
+        vol = math.log(1 + 0.3)
+        spot = 100.0
+        K = 95.0
+        T = 0.5
+        H = 110.0
+        N = 100
+        for model in ["CRR", "JR", "TRG"]:
+            for fast in [False, True]:
+                vanilla = Vanilla("Call", r=risk_free_rate, std=vol, tenor=T, n=N, strike=K, opt="call", fast=fast,
+                                  model=model)
+                knock_out = KnockoutOptions("Up-And-out Call", r=risk_free_rate, std=vol, tenor=T, n=N, strike=K,
+                                            opt="call", barrier=H, move="up", fast=fast, model=model)
+                knock_in = KnockInOptions("Up-And-In Call", r=risk_free_rate, std=vol, tenor=T, n=N, strike=K,
+                                          opt="call", barrier=H, move="up", fast=fast, model=model)
+                if not fast:
+                    expected = [vanilla.price(initSpot=spot, noShares=1),
+                                knock_out.price(initSpot=spot, noShares=1),
+                                knock_in.price(initSpot=spot, noShares=1)]
+                else:
+                    self.assertAlmostEqual(expected[0], vanilla.price(initSpot=spot, noShares=1))
+                    self.assertAlmostEqual(expected[1], knock_out.price(initSpot=spot, noShares=1))
+                    self.assertAlmostEqual(expected[2], knock_in.price(initSpot=spot, noShares=1))
+
+    def test_strike_ladder(self):
+        risk_free_rate = math.log(1 + 0.01)
+        vol = math.log(1 + 0.3)
+        spot = 100.0
+        T = 1.0
+        N = 200
+        strikes = np.linspace(80.0, 120.0, 9)
+        barriers = np.linspace(125.0, 105.0, 9)
+
+        for model in ["CRR", "TRG", "BS"]:
+            ladder = Vanilla("Call", r=risk_free_rate, std=vol, tenor=T, n=None if model == "BS" else N, strike=100.0,
+                             opt="call", model=model).price_strikes(initSpot=spot, strikes=strikes, noShares=1)
+            for K, pv in zip(strikes, ladder):
+                vanilla = Vanilla("Call", r=risk_free_rate, std=vol, tenor=T, n=None if model == "BS" else N,
+                                  strike=K, opt="call", fast=True, model=model)
+                self.assertAlmostEqual(vanilla.price(initSpot=spot, noShares=1), pv)
+
+        for cls in [KnockoutOptions, KnockInOptions]:
+            options = cls("Up-And-X Call", r=risk_free_rate, std=vol, tenor=T, n=N, strike=100.0, opt="call",
+                          barrier=110.0, move="up")
+            ladder = options.price_strikes(initSpot=spot, strikes=strikes, barriers=barriers, noShares=1)
+            for K, H, pv in zip(strikes, barriers, ladder):
+                options = cls("Up-And-X Call", r=risk_free_rate, std=vol, tenor=T, n=N, strike=K, opt="call",
+                              barrier=H, move="up", fast=True)
+                self.assertAlmostEqual(options.price(initSpot=spot, noShares=1), pv)
+
+    def test_numba_slow_version(self):
+        risk_free_rate = math.log(1 + 0.01)
+        vol = math.log(1 + 0.3)
+        T = 1.0
+        N = 150
+        for model in ["CRR", "JR", "TRG"]:
+            for opt, move, spot, K, H in [("call", "up", 100.0, 95.0, 105.0), ("put", "down", 95.0, 100.0, 92.0),
+                                          ("call", "down", 100.0, 100.0, 100.0)]:
+                for cls in [KnockoutOptions, KnockInOptions]:
+                    slow = cls("Barrier", r=risk_free_rate, std=vol, tenor=T, n=N, strike=K, opt=opt, barrier=H,
+                               move=move, model=model, engine="slow")
+                    compiled = cls("Barrier", r=risk_free_rate, std=vol, tenor=T, n=N, strike=K, opt=opt, barrier=H,
+                                   move=move, model=model, engine="numba")
+                    self.assertAlmostEqual(slow.price(initSpot=spot, noShares=1),
+                                           compiled.price(initSpot=spot, noShares=1))
+
+                slow = Vanilla("Vanilla", r=risk_free_rate, std=vol, tenor=T, n=N, strike=K, opt=opt, model=model)
+                compiled = Vanilla("Vanilla", r=risk_free_rate, std=vol, tenor=T, n=N, strike=K, opt=opt, model=model,
+                                   engine="numba")
+                self.assertAlmostEqual(slow.price(initSpot=spot, noShares=1), compiled.price(initSpot=spot, noShares=1))
+
+        self.assertRaises(ValueError, Vanilla, "Vanilla", r=risk_free_rate, std=vol, tenor=T, n=N, strike=100.0,
+                          opt="call", engine="gpu")
+
+    def test_bs_barrier_closed_form(self):
+        r = 0.05
+        vol = 0.25
+        T = 1.0
+        spot = 100.0
+        cases = [("call", "up", 95.0, 120.0), ("call", "down", 95.0, 90.0), ("call", "down", 85.0, 90.0),
+                 ("put", "up", 105.0, 110.0), ("put", "up", 115.0, 110.0), ("put", "down", 105.0, 90.0)]
+        opts, moves, strikes, barriers = [np.array(x) for x in zip(*cases)]
+
+        out_pv = barrier_analytic.price(spot, strikes, barriers, r, vol, T, opts, moves, "out", noShares=1)
+        in_pv = barrier_analytic.price(spot, strikes, barriers, r, vol, T, opts, moves, "in", noShares=1)
+        vanilla_pv = black_scholes.price(spot, strikes, r, vol, T, opts, noShares=1)
+        np.testing.assert_allclose(out_pv + in_pv, vanilla_pv)
+
+        # already crossed at t=0
+        self.assertEqual(0.0, barrier_analytic.price(spot, 95.0, 100.0, r, vol, T, "call", "up", "out"))
+
+        for (opt, move, K, H), pv in zip(cases, out_pv):
+            bs_model = KnockoutOptions("Barrier", r=r, std=vol, tenor=T, n=None, strike=K, opt=opt, barrier=H,
+                                       move=move, model="BS")
+            self.assertAlmostEqual(pv, bs_model.price(initSpot=spot, noShares=1))
+
+        # discretely monitored lattice converges to the continuous barrier from above
+        lattice = KnockoutOptions("Up-And-out Call", r=r, std=vol, tenor=T, n=4000, strike=95.0, opt="call",
+                                  barrier=120.0, move="up", fast=True)
+        self.assertAlmostEqual(out_pv[0], lattice.price(initSpot=spot, noShares=1), delta=0.1)
+
+        bs_model = KnockInOptions("Up-And-In Call", r=r, std=vol, tenor=T, n=None, strike=95.0, opt="call",
+                                  barrier=110.0, move="up", model="BS")
+        np.testing.assert_allclose(bs_model.price_strikes(spot, strikes=[90.0, 100.0], barriers=[110.0, 120.0],
+                                                          noShares=1),
+                                   barrier_analytic.price(spot, [90.0, 100.0], [110.0, 120.0], r, vol, T, "call", "up",
+                                                          "in", noShares=1))
+
+    def test_lattice_greeks(self):
+        S0 = 100
+        K = 110
+        T = 0.5
+        r = np.log(1 + 0.06)
+        sigma = np.log(1 + 0.3)
+
+        lattice = Vanilla("Call", r=r, std=sigma, tenor=T, n=500, strike=K, opt="call", fast=True) \
+            .price_greeks(S0, 1)
+        bs_model = Vanilla("Call", r=r, std=sigma, tenor=T, n=None, strike=K, opt="call", model="BS") \
+            .price_greeks(S0, 1)
+        self.assertAlmostEqual(bs('c', S0, K, T, r, sigma), bs_model["price"])
+        for greek, tolerance in [("price", 0.01), ("delta", 0.001), ("gamma", 0.001), ("theta", 0.001),
+                                 ("vega", 0.005), ("rho", 0.001)]:
+            self.assertAlmostEqual(bs_model[greek], lattice[greek], delta=tolerance)
+
+        # Knock-out + Knock-in = Vanilla holds node by node, so for the greeks too
+        # (barrier vega and rho: on the lattices of n and n+1 periods, see barrier_knockout.layered_price)
+        H = 120
+        for engine in ["slow", "fast", "numba"]:
+            vanilla = Vanilla("Call", r=r, std=sigma, tenor=T, n=100, strike=K, opt="call", engine=engine) \
+                .price_greeks(S0, 1)
+            next_vanilla = Vanilla("Call", r=r, std=sigma, tenor=T, n=101, strike=K, opt="call", engine=engine) \
+                .price_greeks(S0, 1)
+            knock_out = KnockoutOptions("Up-And-out Call", r=r, std=sigma, tenor=T, n=100, strike=K, opt="call",
+                                        barrier=H, move="up", engine=engine).price_greeks(S0, 1)
+            knock_in = KnockInOptions("Up-And-In Call", r=r, std=sigma, tenor=T, n=100, strike=K, opt="call",
+                                      barrier=H, move="up", engine=engine).price_greeks(S0, 1)
+            for greek in ["price", "delta", "gamma", "theta"]:
+                self.assertAlmostEqual(vanilla[greek], knock_out[greek] + knock_in[greek])
+            for greek in ["vega", "rho"]:
+                self.assertAlmostEqual((vanilla[greek] + next_vanilla[greek]) / 2, knock_out[greek] + knock_in[greek])
+
+    def test_barrier_lattice_greeks(self):
+        # vega and rho don't jump with the position of the barrier between the node layers
+        r = math.log(1 + 0.01)
+        sigma = math.log(1 + 0.3)
+        for cls, opt, K, H, move in [(KnockoutOptions, "call", 95.0, 130.0, "up"),
+                                     (KnockInOptions, "call", 95.0, 130.0, "up"),
+                                     (KnockoutOptions, "put", 105.0, 80.0, "down")]:
+            closed_form = cls("BS", r=r, std=sigma, tenor=1.0, n=None, strike=K, opt=opt, barrier=H, move=move,
+                              model="BS").price_greeks(100.0, 1)
+            for model in ["CRR", "JR", "TRG"]:
+                for n in [100, 101, 200, 201, 400, 401]:
+                    lattice = cls("Lattice", r=r, std=sigma, tenor=1.0, n=n, strike=K, opt=opt, barrier=H, move=move,
+                                  model=model, engine="numba").price_greeks(100.0, 1)
+                    for greek in ["vega", "rho"]:
+                        self.assertAlmostEqual(closed_form[greek], lattice[greek],
+                                               delta=0.05 * abs(closed_form[greek]), msg=(cls, model, n, greek))
+
+    def test_convergence_modes(self):
+        S0 = 100
+        K = 110
+        T = 0.5
+        r = np.log(1 + 0.06)
+        sigma = np.log(1 + 0.3)
+        BS = bs('c', S0, K, T, r, sigma)
+
+        # BS smoothed last period + Richardson: BS-level accuracy at N=50
+        bbsr = Vanilla("Call", r=r, std=sigma, tenor=T, n=50, strike=K, opt="call", fast=True, convergence="bbsr")
+        self.assertAlmostEqual(BS, bbsr.price(initSpot=S0, noShares=1), delta=0.001)
+        # odd n: weights n / (n - m) and m / (n - m) with the m = n // 2 lattice
+        for n in [49, 51]:
+            bbsr = Vanilla("Call", r=r, std=sigma, tenor=T, n=n, strike=K, opt="call", fast=True, convergence="bbsr")
+            self.assertAlmostEqual(BS, bbsr.price(initSpot=S0, noShares=1), delta=0.001)
+        self.assertRaises(ValueError, Vanilla("Call", r=r, std=sigma, tenor=T, n=1, strike=K, opt="call",
+                                              convergence="richardson").price, initSpot=S0)
+        bbs = Vanilla("Call", r=r, std=sigma, tenor=T, n=100, strike=K, opt="call", fast=True, convergence="bbs")
+        self.assertAlmostEqual(BS, bbs.price(initSpot=S0, noShares=1), delta=0.005)
+
+        H = 120
+        for convergence in ["bbs", "richardson", "bbsr"]:
+            vanilla = Vanilla("Call", r=r, std=sigma, tenor=T, n=60, strike=K, opt="call",
+                              convergence=convergence).price(initSpot=S0, noShares=1)
+            for engine in ["slow", "fast", "numba"]:
+                knock_out = KnockoutOptions("Up-And-out Call", r=r, std=sigma, tenor=T, n=60, strike=K, opt="call",
+                                            barrier=H, move="up", engine=engine, convergence=convergence)
+                knock_in = KnockInOptions("Up-And-In Call", r=r, std=sigma, tenor=T, n=60, strike=K, opt="call",
+                                          barrier=H, move="up", engine=engine, convergence=convergence)
+                knock_out_pv = knock_out.price(initSpot=S0, noShares=1)
+                knock_in_pv = knock_in.price(initSpot=S0, noShares=1)
+                self.assertAlmostEqual(vanilla, knock_out_pv + knock_in_pv)
+                self.assertAlmostEqual(knock_out_pv, knock_out.price_strikes(S0, strikes=[K], noShares=1)[0])
+                self.assertAlmostEqual(knock_in_pv, knock_in.price_strikes(S0, strikes=[K], noShares=1)[0])
+
+        self.assertRaises(ValueError, Vanilla, "Call", r=r, std=sigma, tenor=T, n=60, strike=K, opt="call",
+                          convergence="aitken")
+
+    def test_pricing_cache(self):
+        r = math.log(1 + 0.01)
+        vol = math.log(1 + 0.3)
+        cache = PricingCache(maxsize=2, spot_quantum=0.01)
+        vanilla = Vanilla("Call", r=r, std=vol, tenor=1.0, n=100, strike=95.0, opt="call", fast=True, cache=cache)
+        knock_out = KnockoutOptions("Up-And-out Call", r=r, std=vol, tenor=1.0, n=100, strike=95.0, opt="call",
+                                    barrier=105.0, move="up", fast=True, cache=cache)
+
+        pv = vanilla.price(initSpot=100.0, noShares=1)
+        self.assertEqual(pv, vanilla.price(initSpot=100.001, noShares=1))  # same entry after quantization
+        self.assertEqual({"size": 1, "maxsize": 2, "hits": 1, "misses": 1, "evictions": 0}, cache.stats())
+
+        # the key covers the contract type and barrier
+        self.assertNotEqual(pv, knock_out.price(initSpot=100.0, noShares=1))
+        self.assertEqual(2, cache.misses)
+
+        # least recently used is evicted
+        vanilla.price(initSpot=101.0, noShares=1)
+        self.assertEqual(1, cache.evictions)
+        knock_out.price(initSpot=100.0, noShares=1)
+        self.assertEqual(2, cache.hits)
+
+        # invalidation
+        self.assertEqual(1, cache.invalidate(spot=101.0))
+        self.assertEqual(1, len(cache))
+        vanilla.std = vol + 0.01
+        vanilla._setup_model()
+        self.assertNotEqual(pv, vanilla.price(initSpot=100.0, noShares=1))
+        self.assertEqual(2, cache.invalidate())
+        self.assertEqual(0, len(cache))
+
+        greeks = vanilla.price_greeks(initSpot=100.0, noShares=1)
+        self.assertEqual(greeks, vanilla.price_greeks(initSpot=100.0, noShares=1))
+
+    def test_implied_vol(self):
+        rng = np.random.default_rng(11)
+        size = 500
+        spot = 100.0
+        strikes = rng.uniform(70, 130, size)
+        vols = rng.uniform(0.05, 1.0, size)
+        tenors = rng.uniform(0.25, 2.0, size)
+        opts = np.where(rng.random(size) < 0.5, "call", "put")
+        r = 0.02
+
+        prices = black_scholes.price(spot, strikes, r, vols, tenors, opts, noShares=1)
+        ivs, converged = implied_vol(prices, spot, strikes, r, tenors, opts, noShares=1)
+        self.assertTrue(np.all(converged))
+        np.testing.assert_allclose(black_scholes.price(spot, strikes, r, ivs, tenors, opts, noShares=1), prices,
+                                   atol=1e-9)
+        # std is only identifiable where the price is sensitive to it
+        sensitive = black_scholes.vega(spot, strikes, r, vols, tenors, noShares=1) > 1e-3
+        np.testing.assert_allclose(ivs[sensitive], vols[sensitive], atol=1e-6)
+        for i in range(0, size, 50):
+            flag = 'c' if opts[i] == "call" else 'p'
+            self.assertAlmostEqual(implied_volatility(prices[i], spot, strikes[i], tenors[i], r, flag), ivs[i], 5)
+
+        # no solution: below intrinsic value, above the spot
+        ivs, converged = implied_vol([0.0, 1e6], spot, 100.0, r, 1.0, "call", noShares=1)
+        self.assertFalse(np.any(converged))
+        self.assertTrue(np.all(np.isnan(ivs)))
+
+        # lattice engine
+        option = Vanilla("Put", r=r, std=0.3, tenor=1.0, n=200, strike=100.0, opt="put", engine="numba")
+        lattice_strikes = np.array([90.0, 100.0, 110.0])
+        lattice_vols = np.array([0.15, 0.3, 0.45])
+        prices = np.array([option._bumped(std=v, strike=k)._engine_price(spot, 1)
+                           for v, k in zip(lattice_vols, lattice_strikes)])
+        ivs, converged = implied_vol_lattice(prices, spot, option, strike=lattice_strikes, noShares=1)
+        self.assertTrue(np.all(converged))
+        np.testing.assert_allclose(ivs, lattice_vols, atol=1e-6)
+
+    def test_barrier_monte_carlo(self):
+        r = math.log(1 + 0.01)
+        vol = math.log(1 + 0.3)
+        T = 1.0
+        for move, opt, spot, K, H in [("up", "call", 100.0, 95.0, 130.0), ("down", "put", 100.0, 105.0, 80.0)]:
+            prices = {}
+            for inout in ["out", "in"]:
+                closed_form = float(barrier_analytic.price(spot, K, H, r, vol, T, opt, move, inout, noShares=1))
+                # monthly grid: unbiased for the continuous barrier with the bridge correction
+                mc = BarrierMC("MC", r=r, std=vol, tenor=T, n=12, strike=K, opt=opt, barrier=H, move=move,
+                               inout=inout, paths=100000, chunk=10000)
+                stats = mc.price_stats(initSpot=spot, noShares=1)
+                self.assertLess(abs(stats["price"] - closed_form), 4 * stats["stderr"])
+                prices[inout] = stats
+
+                # discrete monitoring only: knock-out overpriced, knock-in underpriced
+                mc.bridge = False
+                discrete = mc.price_stats(initSpot=spot, noShares=1)["price"]
+                self.assertGreater((discrete - closed_form) * (1 if inout == "out" else -1), 10 * stats["stderr"])
+
+            vanilla = float(black_scholes.price(spot, K, r, vol, T, opt, noShares=1))
+            self.assertLess(abs(prices["out"]["price"] + prices["in"]["price"] - vanilla),
+                            4 * (prices["out"]["stderr"] + prices["in"]["stderr"]))
+
+        # chunks on threads: same price
+        mc = BarrierMC("MC", r=r, std=vol, tenor=T, n=50, strike=95.0, opt="call", barrier=130.0, move="up",
+                       paths=30000, chunk=7000, workers=4)
+        single = BarrierMC("MC", r=r, std=vol, tenor=T, n=50, strike=95.0, opt="call", barrier=130.0, move="up",
+                           paths=30000, chunk=7000, workers=1)
+        self.assertEqual(mc.price_stats(initSpot=100.0), single.price_stats(initSpot=100.0))
+        self.assertEqual(0.0, mc.price(initSpot=130.0))
+
+        self.assertRaises(ValueError, BarrierMC, "MC", r, vol, T, 50, 95.0, "call", 130.0, "sideways")
+
+    def test_barrier_sobol(self):
+        r = math.log(1 + 0.01)
+        vol = math.log(1 + 0.3)
+        T = 1.0
+        for move, opt, spot, K, H in [("up", "call", 100.0, 95.0, 130.0), ("down", "put", 100.0, 105.0, 80.0)]:
+            for inout in ["out", "in"]:
+                closed_form = float(barrier_analytic.price(spot, K, H, r, vol, T, opt, move, inout, noShares=1))
+                pseudo = BarrierMC("MC", r=r, std=vol, tenor=T, n=12, strike=K, opt=opt, barrier=H, move=move,
+                                   inout=inout, paths=1 << 16, chunk=1 << 13).price_stats(initSpot=spot, noShares=1)
+                sobol = BarrierMC("MC", r=r, std=vol, tenor=T, n=12, strike=K, opt=opt, barrier=H, move=move,
+                                  inout=inout, paths=1 << 16, chunk=1 << 13, generator="sobol", replications=16)
+                stats = sobol.price_stats(initSpot=spot, noShares=1)
+                self.assertEqual(1 << 16, stats["paths"])
+                self.assertLess(abs(stats["price"] - closed_form), 4 * stats["stderr"])
+                # randomized QMC: tighter than the pseudo-random paths
+                self.assertLess(stats["stderr"], pseudo["stderr"] / 2)
+
+        # replications on threads: same price
+        sobol.workers = 4
+        self.assertEqual(stats, sobol.price_stats(initSpot=spot, noShares=1))
+
+        self.assertRaises(ValueError, BarrierMC, "MC", r, vol, T, 12, 95.0, "call", 130.0, "up", generator="halton")
+        self.assertRaises(ValueError, BarrierMC, "MC", r, vol, T, 12, 95.0, "call", 130.0, "up", paths=1000,
+                          generator="sobol", replications=16)
+        self.assertRaises(ValueError, BarrierMC("MC", r, vol, T, 12, 95.0, "call", 130.0, "up", paths=3 * 16,
+                                                generator="sobol", replications=16).price, 100.0)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+
+import numpy as np
+
+from src.qmc import bridge_order, brownian_bridge, normal_blocks
+
+
+class MyTestCase(unittest.TestCase):
+    def test_brownian_bridge(self):
+        for dims in [1, 2, 3, 12, 252]:
+            index, left, right = bridge_order(dims)
+            self.assertEqual(list(range(dims)), sorted(index))
+            self.assertEqual(dims - 1, index[0])
+
+        z = np.random.default_rng(0).standard_normal((200000, 12))
+        increments = brownian_bridge(z)
+        # W(T) from the first dimension only, increments still iid N(0, 1)
+        np.testing.assert_allclose(increments.sum(axis=1), np.sqrt(12) * z[:, 0], atol=1e-12)
+        np.testing.assert_allclose(np.cov(increments.T), np.eye(12), atol=0.02)
+
+    def test_normal_blocks(self):
+        blocks = list(normal_blocks(1024, 12, 300, "sobol", seed=3))
+        self.assertEqual([(256, 12)] * 4, [block.shape for block in blocks])
+        self.assertTrue(np.array_equal(np.vstack(blocks),
+                                       np.vstack(list(normal_blocks(1024, 12, 1024, "sobol", seed=3)))))
+        self.assertFalse(np.array_equal(blocks[0], next(normal_blocks(1024, 12, 300, "sobol", seed=4))))
+
+        # balanced: every coordinate's sample mean is much closer to 0 than pseudo-random's 1/sqrt(n)
+        self.assertLess(np.abs(np.vstack(blocks).mean(axis=0)).max(), 0.01)
+
+        self.assertRaises(ValueError, list, normal_blocks(1000, 12, 100, "sobol"))
+        self.assertRaises(ValueError, list, normal_blocks(1024, 12, 100, "halton"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+
+import numpy as np
+
+from src.model.volatility import daily_variances, rolling, ewma, annualize, to_monthly_percent, \
+    historical_volatility, align, VolatilityTracker
+
+
+def intraday_gbm(days, tickers, std, steps=200, seed=0):
+    # daily close / high / low of GBM paths observed steps times a day, the open is the previous close
+    rng = np.random.default_rng(seed)
+    dt = 1 / 252 / steps
+    log_returns = (-std ** 2 / 2) * dt + std * np.sqrt(dt) * rng.standard_normal((days, steps, tickers))
+    log_spot = np.log(100) + np.cumsum(log_returns.reshape(days * steps, tickers), axis=0).reshape(days, steps, tickers)
+    open_ = np.concatenate([np.full((1, tickers), np.log(100)), log_spot[:-1, -1]])
+    high = np.maximum(log_spot.max(axis=1), open_)
+    low = np.minimum(log_spot.min(axis=1), open_)
+    return np.exp(log_spot[:, -1]), np.exp(high), np.exp(low)
+
+
+class MyTestCase(unittest.TestCase):
+    def test_estimators(self):
+        std = np.array([0.1, 0.3, 0.6])
+        close, high, low = intraday_gbm(1000, 3, std, steps=1000)
+
+        for estimator in ("close", "parkinson", "garman_klass"):
+            vol = historical_volatility(close, high, low, estimator, window=999)
+            self.assertEqual((999, 3), vol.shape)
+            # discrete monitoring puts the range estimators a little low
+            np.testing.assert_allclose(vol[-1], std, rtol=0.06, err_msg=estimator)
+        # the range is more efficient than the close
+        errors = {estimator: np.std(historical_volatility(close, high, low, estimator, window=21)[20:, 1] / 0.3)
+                  for estimator in ("close", "parkinson", "garman_klass")}
+        self.assertLess(errors["parkinson"], errors["close"])
+        self.assertLess(errors["garman_klass"], errors["close"])
+
+        # rolling / ewma against the plain loops
+        variances = daily_variances(close, estimator="close")
+        np.testing.assert_allclose(rolling(variances, 10)[9:], np.array([variances[t - 9:t + 1].mean(axis=0)
+                                                                        for t in range(9, len(variances))]))
+        self.assertTrue(np.all(np.isnan(rolling(variances, 10)[:9])))
+        expected = variances[0].copy()
+        for term in variances[1:]:
+            expected = 0.94 * expected + 0.06 * term
+        np.testing.assert_allclose(ewma(variances, 0.94)[-1], expected)
+
+        # pricer inputs
+        self.assertAlmostEqual(0.2, float(annualize(0.2 ** 2 / 252)), 12)
+        self.assertAlmostEqual(0.2 / np.sqrt(12) * 100, float(to_monthly_percent(0.2)), 12)
+        self.assertRaises(ValueError, historical_volatility, close, estimator="parkinson", window=10)
+        self.assertRaises(ValueError, historical_volatility, close, window=10, lam=0.94)
+
+    def test_missing_prices(self):
+        close, high, low = intraday_gbm(300, 2, np.array([0.2, 0.2]))
+        # second ticker listed on day 100, a missing day on 200
+        close[:100, 1] = np.nan
+        close[200, 0] = np.nan
+        variances = daily_variances(close)
+
+        windowed = rolling(variances, 20)
+        self.assertTrue(np.all(np.isnan(windowed[:119, 1])))
+        self.assertFalse(np.isnan(windowed[119, 1]))
+        self.assertTrue(np.all(np.isnan(windowed[199:220, 0])))
+        self.assertFalse(np.isnan(windowed[220, 0]))
+
+        smoothed = ewma(variances, 0.94)
+        self.assertTrue(np.all(np.isnan(smoothed[:100, 1])))
+        self.assertEqual(variances[100, 1], smoothed[100, 1])
+        self.assertEqual(smoothed[198, 0], smoothed[200, 0])
+
+        # per ticker rows of any dates, aligned on their union
+        dates = np.arange('2015-01-01', '2015-01-11', dtype='datetime64[D]')
+        universe = {'a': {'date': dates[::-1], 'close': np.arange(10.0)[::-1]},
+                    'b': {'date': dates[5:], 'close': np.arange(5.0)}}
+        aligned_dates, tickers, values = align(universe)
+        np.testing.assert_array_equal(dates, aligned_dates)
+        self.assertEqual(['a', 'b'], tickers)
+        np.testing.assert_array_equal(np.arange(10.0), values[:, 0])
+        np.testing.assert_array_equal(np.r_[[np.nan] * 5, np.arange(5.0)], values[:, 1])
+
+    def test_tracker(self):
+        close, high, low = intraday_gbm(500, 3, np.array([0.1, 0.3, 0.6]), seed=1)
+        close[300, 2] = np.nan
+
+        for estimator, window, lam in [("close", 21, None), ("garman_klass", 63, None), ("parkinson", None, 0.97)]:
+            expected = historical_volatility(close, high, low, estimator, window=window, lam=lam)
+            tracker = VolatilityTracker(estimator, window=window, lam=lam)
+            np.testing.assert_allclose(tracker.fit(close[:250], high[:250], low[:250]), expected[248])
+            for t in range(250, 500):
+                np.testing.assert_allclose(tracker.update(close[t], high[t], low[t]), expected[t - 1],
+                                           rtol=1e-10, err_msg=estimator)
+
+        # a single ticker, shorter history than the window
+        tracker = VolatilityTracker(window=21)
+        self.assertTrue(np.isnan(tracker.fit(close[:10, 0])))
+        for t in range(10, 30):
+            tracker.update(close[t, 0])
+        self.assertAlmostEqual(historical_volatility(close[:30, 0], window=21)[-1], float(tracker.volatility), 12)
+        self.assertRaises(ValueError, VolatilityTracker(window=21).update, 100.0)
+        self.assertRaises(ValueError, VolatilityTracker, window=21, lam=0.94)
+
+
+if __name__ == '__main__':
+    unittest.main()